@@ -1,15 +1,16 @@
 from process import AIProcess
 
 import game
+import pathfinding
 import sys
-import time
-import datetime
-import heapq
+import timing
 import pygame
 from random import randint
 
 VISUALIZE = False
 DEBUG = False
+THINK_TIME = 0.095  # Seconds of search per move, unless a think_time is given
+OPPOSITE_DIRECTIONS = [game.RIGHT, game.LEFT, game.DOWN, game.UP]
 
 DIRECTION_SET = {}
 DIRECTION_SET[game.LEFT]  = [(0,-1,game.UP),(0,1,game.DOWN),(-1,0,game.LEFT)]
@@ -27,7 +28,6 @@ class Node(object):
         self.hcost = hcost
         self.fcost = fcost
         self.direction = direction
-        self.rect = pygame.Rect(self.x*game.CELL_WIDTH, self.y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT)
 
     def __gt__(self, other):
         if self.fcost == other.fcost:
@@ -55,21 +55,22 @@ class Node(object):
 
     def draw(self, color):
         if VISUALIZE:
-            pygame.draw.rect(game.screen, color, self.rect)
-
-def heuristic_cost_estimate( node1, node2 ):
-    return node1.distance(node2) * 8
+            pygame.draw.rect(game.screen, color, game.viewport.cell_rect(self.x, self.y))
 
 class JameelAI(AIProcess):
 
     def __init__(self, player, *args, **kwargs):
         super(JameelAI, self).__init__(*args, **kwargs)
+        if self.think_time is None:
+            self.think_time = THINK_TIME
         self.last_known_position = None
         self.previous_move = None
         self.update_position()
         self._goal = None
         self._path = None
-        self.last_shot = 0
+        self.last_shot_tick = -game.ticks_per_second  # Fires at most once a second of game time
+        self.think_start = None
+        self.deadline = None
 
     def update_position(self):
         self.last_known_position = (self.player.x, self.player.y)
@@ -90,109 +91,53 @@ class JameelAI(AIProcess):
             if is_okay(_x, _y):
                 yield Node(_x, _y, _direction)
 
+    def get_path_length(self):
+        return len(self._path or ())
+
     def closest_apple(self, x, y):
-        return min([(self.calculate_distance((x,y), (apple.x,apple.y)), apple) for apple in self.apples])[1]
-
-    def closest_player(self, x, y):
-        min([(self.calculate_distance((player.x, player.y), (x, y)), player) for player in self._players if player != self.player ])[1]
-
-    def get_real_neighbor(self, openset, neighbor):
-        try:
-            real_neighbor = [ n for n in openset if n == neighbor ][0]
-            return real_neighbor
-        except IndexError:
-            return neighbor
-
-
-    def reconstruct_path(self, current):
-        astar_path = []     
-        currentNode = current
-        astar_path.append((currentNode.x, currentNode.y, currentNode.direction))
-        while currentNode.parent != None:
-            currentNode = currentNode.parent
-            astar_path.append((currentNode.x, currentNode.y, currentNode.direction))
-        astar_path.pop()
-        astar_path.reverse()
-        return astar_path
+        nearest = self.get_nearest_apple(x, y)
+        if nearest:
+            return nearest[1]
+        # Ties go to the lowest coordinates, not to whichever object sorts first
+        return min(self.apples, key=lambda apple: (self.calculate_distance((x,y), (apple.x,apple.y)), apple.x, apple.y))
 
     def astar(self, goal):
-
+        """ Searches for a path to _goal_, or to any apple found on the way,
+            as a list of (x, y, direction) moves. Stops at the tick's
+            deadline and then returns the most promising partial path. """
         self._goal = goal
+        grid = self.get_grid()
 
-        def is_apple(node):
-            return self.board[node.x][node.y] == 'A'
+        chars = buffer(self.board)
+        start = grid.index(self.player.x, self.player.y)
+        behind = grid.neighbors[start*4 + OPPOSITE_DIRECTIONS[self.player.direction]]
+        path = grid.find_path(start, grid.index(goal.x, goal.y), pathfinding.passable_from_chars(chars),
+                goals=pathfinding.mask_from_chars(chars, 'A'), excluded=(behind,),
+                heuristic_scale=8, deadline=self.deadline)
 
-        start = Node(self.player.x, self.player.y, self.player.direction)
-        
-        openset   = [start]
-        closedset = set()
-
-        start.cost  = 0
-        start.hcost = goal.distance(start)
-        start.fcost = start.cost + start.hcost
-    
-        start = time.time()
-
-        while openset:
-            current = heapq.heappop(openset)
-            
-            #if is_apple(current):
-            #   goal = current
-
-            if current == goal:
-                return self.reconstruct_path(current)
-
-            closedset.add(current)
-            current.draw(pygame.Color(55, 55, 55))
-
-            for neighbor in self.neighbor_nodes(current.x, current.y, current.direction):
-
-                if self.time_passed() > 95000: #150000: 
-                    break
-
-                if is_apple(neighbor):
-                    goal = neighbor
-                    self._goal = goal
-
-                tentative_cost  = current.cost + current.distance(neighbor)
-                tentative_hcost = heuristic_cost_estimate(goal, neighbor)
-                tentative_fcost = tentative_cost + tentative_hcost
-                
-                if neighbor in closedset and tentative_fcost >= neighbor.fcost:
-                    continue
-
-                neighbor_not_in_openset = neighbor not in openset
-                if neighbor_not_in_openset or tentative_fcost < neighbor.fcost:
-                    neighbor.parent    = current
-                    neighbor.cost      = tentative_cost
-                    neighbor.hcost     = tentative_hcost
-                    neighbor.fcost     = tentative_cost + tentative_hcost
-
-                    neighbor.direction = neighbor.direction
-                    if neighbor_not_in_openset:
-                        heapq.heappush(openset, neighbor)
-                        neighbor.draw(pygame.Color(100, 100, 100))
-                '''
-                real_neighbor = self.get_real_neighbor(openset, neighbor)
-                tentative_cost  = current.cost + current.distance(neighbor)
-                tentative_hcost = heuristic_cost_estimate(goal, neighbor)
-                tentative_fcost = tentative_cost + tentative_hcost
-                if neighbor in closedset and tentative_fcost >= real_neighbor.fcost:
-                    continue
-                neighbor_not_in_openset = neighbor not in openset
-                if neighbor_not_in_openset or tentative_fcost < real_neighbor.fcost:
-                    real_neighbor.parent    = current
-                    real_neighbor.cost      = tentative_cost
-                    real_neighbor.hcost     = tentative_hcost
-                    neighbor.fcost          = tentative_cost + tentative_hcost
-                    real_neighbor.direction = neighbor.direction
-                    if neighbor_not_in_openset:
-                        heapq.heappush(openset, real_neighbor)
-                        real_neighbor.draw(pygame.Color(100, 100, 100))
-                '''
-                
-            if VISUALIZE:
-                pygame.display.flip()
+        if grid.timed_out:
+            if DEBUG: print '+%d:' % self.player_index, "search ran out of time after", grid.last_expanded, "nodes"
+        if VISUALIZE:
+            self.draw_search()
+        if not path:
+            return None
+
+        if not grid.timed_out:
+            self._goal = Node(*grid.coordinates(path[-1]), direction=-1)
+        moves = []
+        for previous, index in zip(path, path[1:]):
+            direction = grid.neighbors[previous*4:previous*4 + 4].index(index)
+            moves.append(grid.coordinates(index) + (direction,))
+        return moves
+
+    def draw_search(self):
+        grid = self.grid
+        for index in range(grid.size):
+            if grid.closed[index] == grid.generation:
+                Node(*grid.coordinates(index), direction=-1).draw(pygame.Color(55, 55, 55))
+            elif grid.is_reached(index):
+                Node(*grid.coordinates(index), direction=-1).draw(pygame.Color(100, 100, 100))
+        pygame.display.flip()
 
     def opponent_ahead(self, next_direction):
         if next_direction != self.player.direction:
@@ -216,16 +161,9 @@ class JameelAI(AIProcess):
         return False
 
     def missile_will_strike(self, x, y):
-        for missile in game.missiles:
-            if missile.x == x and missile.direction in (game.UP, game.DOWN) and self.calculate_distance( (missile.x,missile.y), (x,y) ) <= 6:
-                if DEBUG: print '+%d:' % self.player_index, "Will Strike", (missile.x, missile.y), (x,y), self.calculate_distance( (missile.x,missile.y), (x,y) ) 
-                return True
-            elif missile.y == y and missile.direction in (game.LEFT, game.RIGHT) and self.calculate_distance( (missile.x,missile.y), (x,y) ) <= 6:
-                if DEBUG: print '+%d:' % self.player_index, "Will Strike", (missile.x, missile.y), (x,y), self.calculate_distance( (missile.x,missile.y), (x,y) ) 
-                return True
-            else:
-                if DEBUG: print '+%d:' % self.player_index, "No Strike", (missile.x, missile.y), (x,y), self.calculate_distance( (missile.x,missile.y), (x,y) ) 
-        return False
+        arrival = self.get_missile_arrival(x, y)
+        if DEBUG and arrival >= 0: print '+%d:' % self.player_index, "Will Strike", (x,y), "in", arrival
+        return arrival >= 0
 
     def protect_urself(self, direction):
 
@@ -269,9 +207,6 @@ class JameelAI(AIProcess):
             if DEBUG: print '+%d:' % self.player_index, "no Safe Move:"
         return direction
 
-    def time_passed(self):
-        return (datetime.datetime.now() - self.start).microseconds
-
     def execute(self):
 
 
@@ -279,7 +214,8 @@ class JameelAI(AIProcess):
             return
     
         if DEBUG: print '+%d:' % self.player_index, "enter execute"
-        self.start = datetime.datetime.now()
+        self.think_start = timing.monotonic()
+        self.deadline = self.think_start + self.think_time
 
         if DEBUG: 
             if self.calculate_distance( self.last_known_position, (self.player.x, self.player.y) ) > 1:
@@ -316,10 +252,10 @@ class JameelAI(AIProcess):
 
         should_shoot = self.opponent_ahead(next_direction)
         if should_shoot:
-            if time.time()-self.last_shot < 1:
+            if self.tick - self.last_shot_tick < game.ticks_per_second:
                 should_shoot = False
             else:
-                self.last_shot = time.time()
+                self.last_shot_tick = self.tick
 
         if next_direction != self.player.direction or should_shoot:
             if next_direction == game.UP:
@@ -337,5 +273,5 @@ class JameelAI(AIProcess):
         else:
             pass
 
-        if DEBUG: print '+%d:' % self.player_index, "exit execute, time_passed=",self.time_passed()
+        if DEBUG: print '+%d:' % self.player_index, "exit execute, time_passed=", timing.monotonic() - self.think_start
 
@@ -1,123 +1,75 @@
 from collections import deque
-from heapq import heappush, heappop
 from operator import itemgetter
 
 import pygame
 from pygame.locals import *
 
+import board
 import game
 import game_objects
+import instrumentation
+import pathfinding
+
+DEBUG = False
+BLOCKING_CELLS = (board.WALL, board.INDESTRUCTABLE_WALL, board.SNAKE, board.MISSILE)
+DIRECTION_OFFSETS = {game.LEFT: (-1, 0), game.RIGHT: (1, 0), game.UP: (0, -1), game.DOWN: (0, 1)}
 
 class AStar(object):
+    """ A* over the board's cells, run by a shared pathfinding.Grid.
+
+        Subclasses say which cells can be entered through get_passable(), and
+        may exclude cells for a single search (get_excluded_nodes()) or offer
+        other acceptable goals (get_alternate_goals()). """
     def __init__(self):
-        self.closed_set = set()
-        self.open_set = set()  # We use set for fast membership tests
-        self.open_heap = []  # We use heap for fast min checks
-        self.nodes = {}
+        self.grid = None
 
         self.enable_path_visualization = False
         self.wrap_coordinates = False
         self.retarget_alternate_goals = False
 
-    def is_neighbor(self, node):
-        raise Exception("Not implemented")
+    def get_passable(self):
+        """ Returns a bytearray, indexed by flat cell index, that is true for
+            cells the path may enter. """
+        raise NotImplementedError
 
-    def is_alternate_goal(self, node):
-        raise Exception("Not implemented")
+    def get_excluded_nodes(self):
+        return ()
 
-    def wrap_node(self, node):
-        raise Exception("Not implemented")
+    def get_alternate_goals(self):
+        """ Returns a bytearray that is true for cells that are just as good
+            as the goal. Only used if _retarget_alternate_goals_ is set. """
+        raise NotImplementedError
 
     def draw_node(self, node, color):
-        raise Exception("Not implemented")
-
-    def movement_cost(self, node1, node2):
-        raise Exception("Not implemented")
-
-    def heuristic_estimate_cost(self, start, goal):
-        raise Exception("Not implemented")
-
-    def _retrace_path(self, node):
-        if self.nodes[node]['parent'] is None:
-            return [node]
-        else:
-            return self._retrace_path(self.nodes[node]['parent']) + [node]
-
-    def retrace_path(self, node):
-        path = self._retrace_path(node)
-        if self.enable_path_visualization:
-            for p in path:
-                self.draw_node(p, pygame.Color("red"))
-        return path
-
-    def open_set_add(self, node):
-        heappush(self.open_heap, (self.nodes[node]['f'], self.nodes[node]['h'], node))
-        self.open_set.add(node)
-
-    def open_set_remove(self, node):
-        self.open_heap.remove((self.nodes[node]['f'], self.nodes[node]['h'], node))
-        self.open_set.remove(node)
-
-    def open_set_pop_lowest_f_score(self):
-        node = heappop(self.open_heap)[2]
-        self.open_set.remove(node)
-        return node
-
-    def clear_data(self):
-        self.open_set = set()
-        self.open_heap = []
-        self.closed_set = set()
-        self.nodes = {}
+        raise NotImplementedError
+
+    def get_grid(self):
+        if self.grid is None or (self.grid.width, self.grid.height) != (game.BOARD_WIDTH, game.BOARD_HEIGHT):
+            self.grid = pathfinding.Grid(game.BOARD_WIDTH, game.BOARD_HEIGHT, self.wrap_coordinates)
+        return self.grid
+
+    def visualize_search(self, path):
+        grid = self.grid
+        for index in range(grid.size):
+            if grid.closed[index] == grid.generation:
+                self.draw_node(grid.coordinates(index), pygame.Color("green"))
+            elif grid.is_reached(index):
+                self.draw_node(grid.coordinates(index), pygame.Color("cyan"))
+        for node in path or ():
+            self.draw_node(node, pygame.Color("red"))
 
     def get_path(self, start, goal):
-        self.clear_data()
-
-        # Add start node to the open set
-        h = self.heuristic_estimate_cost(start, goal)
-        self.nodes[start] = {'g': 0, 'h': h, 'f': h, 'parent': None}
-        self.open_set_add(start)        
- 
-        while self.open_set:
-            # Choose lowest f-score in the open list. Use h-score as a tie-breaker
-            current = self.open_set_pop_lowest_f_score()
-            self.closed_set.add(current)
-            if current == goal:
-                return self.retrace_path(current)
-
-            # Draw the closed set
-            if self.enable_path_visualization:
-                self.draw_node(current, pygame.Color("green"))
-
-            # Get neighbors
-            neighbors = []
-            direction_offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]  # Left, right, up, down
-            for ox, oy in direction_offsets:
-                neighbor = (current[0]+ox, current[1]+oy) 
-                if self.wrap_coordinates:
-                    neighbor = self.wrap_node(neighbor)
-                if self.is_neighbor(neighbor):
-                    neighbors.append(neighbor)
-
-            # Calculate path scores
-            for neighbor in neighbors:
-                g = self.nodes[current]['g'] + self.movement_cost(current, neighbor)
-                if neighbor in self.open_set and g < self.nodes[neighbor]['g']:
-                    self.open_set_remove(neighbor)
-                if neighbor in self.closed_set and g < self.nodes[neighbor]['g']:
-                    self.closed_set.remove(neighbor)
-                if neighbor not in self.open_set and neighbor not in self.closed_set:
-                    h = self.heuristic_estimate_cost(neighbor, goal)
-                    self.nodes[neighbor] = {'g': g, 'h': h, 'f': g+h, 'parent': current}
-                    self.open_set_add(neighbor)
-                    # Draw the open set
-                    if self.enable_path_visualization:
-                        self.draw_node(neighbor, pygame.Color("cyan"))
-                # If we find a different goal we like, return the path to it.
-                if self.retarget_alternate_goals and neighbor != goal and self.is_alternate_goal(neighbor):
-                    return self.retrace_path(neighbor)
-
-        # If no path was found
-        return False
+        """ Returns the list of nodes from _start_ to _goal_ (or to an
+            alternate goal found on the way), or False if there is none. """
+        grid = self.get_grid()
+        goals = self.get_alternate_goals() if self.retarget_alternate_goals else None
+        excluded = [grid.index(*node) for node in self.get_excluded_nodes()]
+        path = grid.find_path(grid.index(*start), grid.index(*goal), self.get_passable(), goals, excluded)
+        if path is not None:
+            path = [divmod(index, grid.height) for index in path]
+        if self.enable_path_visualization:
+            self.visualize_search(path)
+        return path or False
 
 class JasonAI(AStar):
     MAX_SAFETY_SCORE = 100
@@ -139,17 +91,16 @@ class JasonAI(AStar):
         self.path = None
 
         self.survival_cycles = 0
+        self.stats = instrumentation.AIStats()
 
-    def is_neighbor(self, node):
-        node_behind_player = self.node_at_direction(self.get_opposite_direction(self.player.direction))
-        return not self.is_out_of_bounds(node) and self.is_traversable(node) and node != node_behind_player
+    def get_passable(self):
+        return pathfinding.passable_from_cells(game.board.cells, BLOCKING_CELLS)
 
-    def is_alternate_goal(self, node):
-        if self.is_apple(node):
-            # print "Found a different apple!"
-            return True
-        else:
-            return False
+    def get_excluded_nodes(self):
+        return [self.node_at_direction(self.get_opposite_direction(self.player.direction))]
+
+    def get_alternate_goals(self):
+        return bytearray((game.board.cells.ravel() == board.APPLE).tostring())
 
     def wrap_node(self, node):
         x, y = node
@@ -164,10 +115,7 @@ class JasonAI(AStar):
         return (x, y)
 
     def draw_node(self, node, color):
-        pygame.draw.rect(game.screen, color, pygame.Rect(node[0]*game.CELL_WIDTH, node[1]*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT))
-
-    def movement_cost(self, node1, node2):
-        return 1
+        pygame.draw.rect(game.screen, color, game.viewport.cell_rect(node[0], node[1]))
 
     def heuristic_estimate_cost(self, start, goal):
         x_distance = abs(start[0]-goal[0])
@@ -181,27 +129,43 @@ class JasonAI(AStar):
         return not (0 <= node[0] < game.BOARD_WIDTH and 0 <= node[1] < game.BOARD_HEIGHT)
 
     def is_traversable(self, node):
-        return self.get_board_object(node) is None or self.is_apple(node)
+        return game.board.cells[node] in (board.EMPTY, board.APPLE)
 
     def is_apple(self, node):
-        return isinstance(self.get_board_object(node), game_objects.Apple)
+        return game.board.cells[node] == board.APPLE
 
     def is_snake_head(self, node):
         obj = self.get_board_object(node)
         return isinstance(obj, game_objects.SnakePart) and (obj.x, obj.y) == (obj.player.x, obj.player.y)
 
     def is_missile(self, node):
-        return isinstance(self.get_board_object(node), game_objects.Missile)
+        return game.board.cells[node] == board.MISSILE
 
     def is_wall(self, node):
-        return isinstance(self.get_board_object(node), game_objects.Wall)
+        return game.board.cells[node] == board.WALL
+
+    def get_apple_field_path(self):
+        """ Follows the game's apple distance field, which goes around walls
+            and snakes, from our head down to the closest apple. Returns the
+            nodes after the head, or None if it doesn't lead to an apple. """
+        grid = self.get_grid()
+        path = grid.descend_path(game.apple_distances, grid.index(self.player.x, self.player.y))
+        if not path:
+            return None
+        path = [divmod(index, grid.height) for index in path]
+        if not self.is_apple(path[-1]):
+            return None
+        return path
 
     def get_closest_apple(self):
-        apple = min((self.heuristic_estimate_cost((self.player.x, self.player.y), (apple.x, apple.y)), apple) for apple in game.apples)[1]
+        path = self.get_apple_field_path()
+        if path:
+            return path[-1]
+        apple = min(game.apples, key=lambda apple: (self.heuristic_estimate_cost((self.player.x, self.player.y), (apple.x, apple.y)), apple.x, apple.y))
         return (apple.x, apple.y)
 
     def get_board_object(self, node):
-        return game.board[node[0]][node[1]]
+        return game.board.get(node[0], node[1])
 
     def translate_direction(self, facing_direction, going_direction):
         left = {game.LEFT: game.DOWN, game.RIGHT: game.UP, game.UP: game.LEFT, game.DOWN: game.RIGHT}
@@ -222,8 +186,7 @@ class JasonAI(AStar):
     def node_at_direction(self, direction, start_node=None, steps=1):
         """Gets the node to the left / right / up / down from the player or given start node."""
         start_node = start_node or (self.player.x, self.player.y)
-        offsets = {game.LEFT: (-1, 0), game.RIGHT: (1, 0), game.UP: (0, -1), game.DOWN: (0, 1)}
-        ox, oy = offsets[direction]
+        ox, oy = DIRECTION_OFFSETS[direction]
         return self.wrap_node((start_node[0] + ox*steps, start_node[1] + oy*steps))
 
     # def node_at_offset(self, offset, start_node=None):
@@ -276,6 +239,11 @@ class JasonAI(AStar):
             else:
                 return 30
 
+        # Missile on its way (Certain death). Arriving in 1-3 ticks, you die next turn. In 4, you die at beginning of 2nd turn.
+        arrival = game.missile_ticks[node_to_check[0]*game.BOARD_HEIGHT + node_to_check[1]]
+        if 1 <= arrival <= 4:
+            return arrival - 1
+
         # Look ahead in each direction
         look_ahead = 5
         for direction in directions:
@@ -286,11 +254,6 @@ class JasonAI(AStar):
                 for node in nodes_in_range:
                     self.draw_node(node, pygame.Color("cyan"))
 
-            # Missile in range (Certain death). Look-ahead 1-3, you die next turn. Look-ahead 4, you die at beginning of 2nd turn.
-            for i, node in enumerate(nodes_in_range[:4]):
-                if self.is_missile(node) and self.get_board_object(node).direction == self.get_opposite_direction(direction):
-                    return 0 + i
-
             # Player in range (Certain death if opponent doesnt turn away). If neither player turns away, you die next turn.
             if self.is_snake_head(nodes_in_range[0]) and self.get_board_object(nodes_in_range[0]).player is not self.player:
                 return 20
@@ -330,6 +293,14 @@ class JasonAI(AStar):
         return self.node_at_direction(safest_direction)
 
     def prepare_closest_apple_path(self):
+        # The distance field already gives a shortest path, unless a missile
+        # is in the way
+        path = self.get_apple_field_path()
+        if path and path[0] not in self.get_excluded_nodes() and not any(self.is_missile(node) for node in path):
+            self.destination = path[-1]
+            self.path = deque(path)
+            return
+
         self.destination = self.get_closest_apple()
         path = self.get_path((self.player.x, self.player.y), self.destination)
         if path:
@@ -469,7 +440,17 @@ class JasonAI(AStar):
                 # pygame.time.wait(1000*10)
 
     def press_key(self, direction):
-        pygame.event.post(pygame.event.Event(KEYDOWN, {'key': game.player_controls[self.player.player_number][direction]}))
+        # Steer the player directly rather than posting a KEYDOWN event, so the
+        # AI also works when there is no display or event queue.
+        self.player.set_direction(direction)
+
+    def step(self):
+        """ Runs execute() and records how it went. JasonAI reads the game
+            directly, so unlike AIProcess.step() there's no state to copy. """
+        grid = self.get_grid()
+        self.stats.begin(grid)
+        self.execute()
+        self.stats.end(game.tick, grid, len(self.path or ()))
 
     def execute(self):
         # # Skip if player has not yet moved
@@ -483,7 +464,7 @@ class JasonAI(AStar):
             try:
                 self.direction_to_node(self.path[0])
             except Exception:
-                print "Path broke. Reassigning a new path..."
+                if DEBUG: print "Path broke. Reassigning a new path..."
                 self.path = None
 
         # Decide whether to shoot a missile
@@ -492,10 +473,11 @@ class JasonAI(AStar):
 
         # Get the next move
         self.prepare_path()
+        next_direction = self.player.direction  # Keep going if there's no path
         try:
             next_direction = self.direction_to_node(self.path.popleft())
         except Exception:
-            print "Path broke. Reassigning a new path..."
+            if DEBUG: print "Path broke. Reassigning a new path..."
             self.path = None
 
         if next_direction != self.player.direction:
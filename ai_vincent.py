@@ -1,11 +1,12 @@
-import heapq
 import time
-from collections import deque, defaultdict
+from collections import deque
 
+import numpy
 import pygame
 
 from process import AIProcess
 import game
+import pathfinding
 
 VISUALIZE = False
 OPPOSITE_DIRECTIONS = [game.RIGHT, game.LEFT, game.DOWN, game.UP,]
@@ -17,19 +18,6 @@ firing_range = 0
 class Node(object):
     def __init__(self, x, y):
         self.x, self.y = x, y
-        self.f_score = 0
-        self.g_score = 0
-        self.h_score = 0
-
-        width = game.CELL_WIDTH
-        height = game.CELL_HEIGHT
-        self.rect = pygame.Rect(x*width, y*height, width, height)
-
-    def __lt__(self, other):
-        """ Used by heapq for maintaining the priority queue. """
-        if self.f_score == other.f_score:
-            return self.h_score < other.h_score
-        return self.f_score < other.f_score
 
     def __eq__(self, other):
         """ Used to compare nodes. Nodes are the same if their coordinates are
@@ -43,19 +31,15 @@ class Node(object):
 
     def __hash__(self):
         """ Used on members of hashed collections, i.e. sets and dictionaries.
-            Here we want nodes to be unique by their coodinates in the
-            closed_set. """
-        return int('1%d%d' % (self.x, self.y))
-
-    def __repr__(self):
-        return '%d, %d, %d, %d' % (self.x, self.y, self.g_score, self.f_score)
+            Here we want nodes to be unique by their coodinates. """
+        return self.x*game.BOARD_HEIGHT + self.y
 
     def get_coordinates(self):
         return (self.x, self.y)
 
     def draw(self, color):
         if VISUALIZE:
-            pygame.draw.rect(game.screen, color, self.rect)
+            pygame.draw.rect(game.screen, color, game.viewport.cell_rect(self.x, self.y))
 
 class VincentAI(AIProcess):
     def __init__(self, player, *args, **kwargs):
@@ -65,6 +49,7 @@ class VincentAI(AIProcess):
         self.path = None
         self.node = None
         self.board_modifiers = None
+        self.board_weights = None
         self.update_board_modifiers()
 
     def update_position(self):
@@ -104,7 +89,7 @@ class VincentAI(AIProcess):
                     continue
                 possible_moves.append(n)
             if possible_moves:
-                next_move = min([(self.board_modifiers[m.x][m.y], m) for m in possible_moves])[1]
+                next_move = min(possible_moves, key=lambda m: self.board_modifiers[m.x][m.y])
 
         moved = False
         for direction in [game.LEFT, game.RIGHT, game.UP, game.DOWN,]:
@@ -119,6 +104,9 @@ class VincentAI(AIProcess):
             self.path = None
             self.update_board_modifiers()
 
+    def get_path_length(self):
+        return len(self.path or ())
+
     def reconsider_path(self):
         if not self.path or self.board[self.goal.x][self.goal.y] != 'A':
             return True
@@ -132,45 +120,21 @@ class VincentAI(AIProcess):
         return False
 
     def update_board_modifiers(self):
-        """ Update modifiers that are used in A* heuristic estimates. """
-        self.board_modifiers = [[0,] * game.BOARD_HEIGHT for i in range(game.BOARD_WIDTH)]
-        for x, row in enumerate(self.board):
-            for y, obj in enumerate(row):
-                if obj in ('W', 'I', 'S', 'M',):
-                    for i in (-1, 0, 1,):
-                        for j in (-1, 0, 1):
-                            _x, _y = x + i, y + j
-                            # Account for board wrapping
-                            if _x < 0:
-                                _x = game.BOARD_WIDTH-1
-                            if _x >= game.BOARD_WIDTH:
-                                _x = 0
-                            if _y < 0:
-                                _y = game.BOARD_HEIGHT-1
-                            if _y >= game.BOARD_HEIGHT:
-                                _y = 0
-                            self.board_modifiers[_x][_y] += 1
+        """ Update modifiers that are used in A* heuristic estimates: the
+            number of obstacles in each cell's 3x3 neighbourhood, with board
+            wrapping. Computed as a box sum over the whole board at once. """
+        obstacles = numpy.frombuffer(pathfinding.mask_from_chars(buffer(self.board), 'WISM'), dtype=numpy.uint8)
+        obstacles = obstacles.reshape(game.BOARD_WIDTH, game.BOARD_HEIGHT).astype(numpy.int32)
+        columns = obstacles + numpy.roll(obstacles, 1, 0) + numpy.roll(obstacles, -1, 0)
+        self.board_modifiers = columns + numpy.roll(columns, 1, 1) + numpy.roll(columns, -1, 1)
+        # Flattened to cell indices for the pathfinding grid
+        self.board_weights = self.board_modifiers.ravel().tolist()
 
     def update_enemy_positions(self):
-        """ Update possible positions enemies up to _firing_range_ turns later. """
-        self.player_positions = defaultdict(set)
-        self.missile_positions = [[0,] * game.BOARD_HEIGHT for i in range(game.BOARD_WIDTH)]
-        for i in range(1, firing_range + 1):
-            if i == 1:
-                nodes = [Node(player.x, player.y) for player in self._players if Node(player.x, player.y) != self.node]
-            else:
-                nodes = self.player_positions[i - 1]
-            for node in nodes:
-                for direction in [game.LEFT, game.RIGHT, game.UP, game.DOWN,]:
-                    next_move = self.get_node_in_direction(node, direction)
-                    if self.board[next_move.x][next_move.y] not in ('W', 'I', 'S', 'M',):
-                        self.player_positions[i].add(next_move)
-
-        for m in game.missiles:
-            node = Node(m.x, m.y)
-            for i in range(6):
-                node = self.get_node_in_direction(node, m.direction)
-                self.missile_positions[node.x][node.y] = 1
+        """ Update cells missiles will hit, or enemies could fire at, up to 6
+            turns later. Where enemies can move is read from the game's danger
+            map by get_enemy_reach(). """
+        self.missile_positions = numpy.frombuffer(self.missile_ticks, dtype=numpy.int32).reshape(game.BOARD_WIDTH, game.BOARD_HEIGHT) >= 0
 
         for player in self._players:
             node = Node(player.x, player.y)
@@ -188,19 +152,26 @@ class VincentAI(AIProcess):
             node = self.get_node_in_direction(node, self.player.direction)
             if self.board[node.x][node.y] in ('W', 'I', 'S',):
                 return False
-            if node in self.player_positions[i//3 + 1]:
+            if 0 < self.get_enemy_reach(node.x, node.y) <= i//3 + 1:
                 return True
         return False
 
     def get_apples(self, player, apples=None):
-        """ Returns list of apples sorted by distance from player. """
+        """ Returns list of (distance, apple) sorted by distance from player,
+            ties by position so the order doesn't depend on where the apples
+            happen to be in memory. """
         apples = apples or self.apples
         apples = [(self.dist_between(player, apple), apple) for apple in apples]
-        return sorted(apples)
+        return sorted(apples, key=lambda (dist, apple): (dist, apple.x, apple.y))
+
+    def get_closest_apple(self, player):
+        """ Returns (distance, apple) for the apple closest to player, going
+            around obstacles when the shared distance field allows it. """
+        return self.get_nearest_apple(player.x, player.y) or self.get_apples(player)[0]
 
     def get_players_apples(self):
         """ Get list of players and the their closest apples. """
-        return [(player, self.get_apples(player)[0]) for player in self._players]
+        return [(player, self.get_closest_apple(player)) for player in self._players]
 
     def get_viable_apples(self):
         """ Filter out apples that are closer to other players than you. """
@@ -215,7 +186,12 @@ class VincentAI(AIProcess):
         """ Get apples from list of viable apples sorted by distance from
             player. """
         apples = self.get_viable_apples() or self.apples
-        return self.get_apples(self.player, apples)
+        best_apples = self.get_apples(self.player, apples)
+        closest = self.get_nearest_apple(self.player.x, self.player.y)
+        if closest and closest[1] in apples:
+            best_apples.remove((self.dist_between(self.player, closest[1]), closest[1]))
+            best_apples.insert(0, closest)
+        return best_apples
 
     def dist_between(self, node1, node2):
         """ Calculate the least number of steps between node1 and node2. Takes into
@@ -226,43 +202,31 @@ class VincentAI(AIProcess):
             min(distance_y, game.BOARD_HEIGHT - distance_y)
 
     def a_star(self, goal):
+        """ Returns the path to _goal_ as a deque of coordinates, next move
+            last, or None if there is none. """
+        grid = self.get_grid()
         start = Node(self.player.x, self.player.y)
         behind_node = self.get_node_in_direction(start, OPPOSITE_DIRECTIONS[self.player.direction])
-        closed_set = set([behind_node,]) # The set of nodes already evaluated
-        open_heap = [start] # The set of tentative nodes to be evaluated
-        came_from = {} # The map of navigated nodes
-
-        start.g_score = 0 # Cost from start along best known path
-        start.h_score = self.heuristic_cost_estimate(start, goal)
-        # Estimated total cost from start to goal through y
-        start.f_score = start.g_score + start.h_score
-
-        while open_heap:
-            current = heapq.heappop(open_heap)
-            if current == goal:
-                if VISUALIZE:
-                    pygame.display.flip()
-                return self.reconstruct_path(came_from, goal.get_coordinates())
-            closed_set.add(current)
-            current.draw(pygame.Color(55, 55, 55))
-
-            for neighbor in self.get_walkable_neighbors(current):
-                tentative_g_score = current.g_score + self.dist_between(current, neighbor)
-                tentative_h_score = self.heuristic_cost_estimate(neighbor, goal)
-                tentative_f_score = tentative_g_score + tentative_h_score
-                if neighbor in closed_set and tentative_f_score >= neighbor.f_score:
-                    continue
+        passable = pathfinding.passable_from_chars(buffer(self.board))
 
-                if neighbor not in open_heap or tentative_f_score < neighbor.f_score:
-                    came_from[neighbor.get_coordinates()] = current.get_coordinates()
-                    neighbor.g_score = tentative_g_score
-                    neighbor.h_score = tentative_h_score
-                    neighbor.f_score = tentative_f_score
-                    if neighbor not in open_heap:
-                        heapq.heappush(open_heap, neighbor)
-                        neighbor.draw(pygame.Color(100, 100, 100))
-        # No path found
-        self.path = None
+        path = grid.find_path(grid.index(start.x, start.y), grid.index(goal.x, goal.y), passable,
+                excluded=(grid.index(behind_node.x, behind_node.y),),
+                heuristic_scale=HEURISTIC_SCALE, weights=self.board_weights)
+        if VISUALIZE:
+            self.draw_search()
+        if not path:
+            self.path = None
+            return None
+        return deque(grid.coordinates(index) for index in reversed(path[1:]))
+
+    def draw_search(self):
+        grid = self.grid
+        for index in range(grid.size):
+            if grid.closed[index] == grid.generation:
+                Node(*grid.coordinates(index)).draw(pygame.Color(55, 55, 55))
+            elif grid.is_reached(index):
+                Node(*grid.coordinates(index)).draw(pygame.Color(100, 100, 100))
+        pygame.display.flip()
 
     def get_walkable_neighbors(self, node):
         """ Evaluate the node's 4 neighbors and return the walkable ones. """
@@ -272,18 +236,6 @@ class VincentAI(AIProcess):
             if self.board[x][y] not in ('W', 'I', 'S', 'M'):
                 yield neighbor
 
-    def heuristic_cost_estimate(self, start, goal):
-        estimate = self.dist_between(start, goal) * HEURISTIC_SCALE
-        estimate += self.board_modifiers[start.x][start.y] * HEURISTIC_SCALE
-        return estimate
-
-    def reconstruct_path(self, came_from, current_node):
-        path = deque()
-        while current_node in came_from:
-            path.append(current_node)
-            current_node = came_from[current_node]
-        return path
-
     def get_node_in_direction(self, node, direction):
         x, y = node.x, node.y
         if direction == game.LEFT:
@@ -0,0 +1,322 @@
+""" Times the game loop on fixed scenarios, so changes to the rules, the
+    effects, the renderer or the AIs can be compared against a baseline.
+
+    Every level in levels/ is loaded with each scenario (the level as it
+    starts, four snakes grown to 50 parts, a storm of missiles with
+    explosions, and a board nearly filled with walls) and played for a fixed
+    number of ticks under the AIs. Each part of a frame is timed on its own:
+    game.update(), the shared state sync, updating and drawing the effects,
+    drawing the whole frame (but the effects), drawing it with the dirty
+    renderer (effects included), stepping all the AIs, and every AI's
+    execute(). Results are written as JSON:
+
+        python benchmark.py --output before.json
+        python benchmark.py --output after.json
+        python benchmark.py --compare before.json after.json
+
+    --snakes runs each scenario again with that many AI snakes, as in an
+    arena, to see how the game and the AIs scale with the number of snakes:
+
+        python benchmark.py levels/level_arena.ini --snakes 16 --snakes 64 --snakes 256
+
+    Rendering uses SDL's dummy video driver unless SDL_VIDEODRIVER is set, so
+    it runs on servers without a display.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # Keep stdout for the JSON
+
+import numpy
+import pygame
+
+import board
+import game
+import game_effects
+import game_objects
+import level
+import simulation
+from renderer import DirtyRenderer
+from timing import monotonic
+
+SNAKE_LENGTH = 50
+STORM_MISSILES = 40  # Missiles kept in flight by the missile storm
+STORM_EXPLOSION_INTERVAL = 10  # Ticks between the storm's explosions
+FULL_BOARD_FRACTION = 0.9  # Share of the free cells the near-full board fills
+THRESHOLD = 10.0  # Percent slowdown reported as a regression
+NOISE_MS = 0.05  # Slowdowns smaller than this are never regressions
+PERCENTILES = (50, 95, 99)
+
+DIRECTION_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))  # In game.LEFT, RIGHT, UP, DOWN order
+
+def grow_snake(player, length, rng):
+    """ Walks _player_ over empty cells, growing it by a part per step, until
+        it is _length_ parts long or boxed in. """
+    while player.get_length() < length:
+        directions = [d for d in range(4) if d != player.direction]
+        rng.shuffle(directions)
+        for direction in [player.direction] + directions:
+            dx, dy = DIRECTION_STEPS[direction]
+            x, y = (player.x + dx) % game.BOARD_WIDTH, (player.y + dy) % game.BOARD_HEIGHT
+            if game.board.get_type(x, y) == board.EMPTY:
+                break
+        else:
+            return
+        player.direction = direction
+        player.grow = True
+        player.update_position()
+
+def fire_random_missile(rng):
+    cell = game.board.random_free_cell(rng)
+    if cell is not None:
+        player = game.players[rng.randrange(len(game.players))]
+        game_objects.Missile(player, cell[0], cell[1], rng.randrange(4), player.color)
+
+class Scenario(object):
+    """ A starting position set up on a freshly loaded level, and whatever
+        has to happen every tick to keep it going. """
+    name = None
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def setup(self):
+        pass
+
+    def tick(self):
+        pass
+
+class DefaultScenario(Scenario):
+    """ The level as it starts. """
+    name = 'default'
+
+class LongSnakesScenario(Scenario):
+    """ Every snake grown to SNAKE_LENGTH parts. """
+    name = 'long_snakes'
+
+    def setup(self):
+        for player in game.players:
+            grow_snake(player, SNAKE_LENGTH, self.rng)
+
+class MissileStormScenario(Scenario):
+    """ STORM_MISSILES missiles flying about at random, topped up every tick,
+        and an explosion every STORM_EXPLOSION_INTERVAL ticks. """
+    name = 'missile_storm'
+
+    def setup(self):
+        self.ticks = 0
+        self.tick()
+
+    def tick(self):
+        while len(game.missiles) < STORM_MISSILES and game.board.count_free_cells():
+            fire_random_missile(self.rng)
+        self.ticks += 1
+        if not self.ticks % STORM_EXPLOSION_INTERVAL:
+            cell = game.board.random_free_cell(self.rng)
+            if cell is not None:
+                player = self.rng.choice(game.players)
+                game_effects.add_explosion(cell[0]*game.CELL_WIDTH, cell[1]*game.CELL_HEIGHT, player.color)
+
+class NearFullScenario(Scenario):
+    """ Walls on FULL_BOARD_FRACTION of the free cells. """
+    name = 'near_full'
+
+    def setup(self):
+        for i in range(int(game.board.count_free_cells() * FULL_BOARD_FRACTION)):
+            x, y = game.board.random_free_cell(self.rng)
+            game.walls.append(game_objects.Wall(x, y))
+
+SCENARIOS = [DefaultScenario, LongSnakesScenario, MissileStormScenario, NearFullScenario]
+SCENARIO_CLASSES = dict((_class.name, _class) for _class in SCENARIOS)
+
+def summarize(times_ms):
+    """ {'p50', 'p95', 'p99', 'max', 'mean'} of a list of timings. """
+    values = numpy.array(times_ms, dtype=float)
+    summary = dict(('p%d' % p, float(value)) for p, value in zip(PERCENTILES, numpy.percentile(values, PERCENTILES)))
+    summary['max'] = float(values.max())
+    summary['mean'] = float(values.mean())
+    return summary
+
+def run(level_file, scenario_class, ticks, seed, render=True, snakes=None, batch_size=None):
+    """ Plays _ticks_ ticks of a scenario on a level, with the AI Demo's
+        line-up or _snakes_ AI snakes, and returns {measurement: summary}
+        with the timings in milliseconds. """
+    ai_classes = simulation.get_line_up(snakes) if snakes else None
+    sim = simulation.Simulation(level.Level(level_file), ai_classes, seed=seed, batch_size=batch_size)
+    sim.setup()
+    game.headless = not render
+    scenario = scenario_class(seed)
+    scenario.setup()
+    game.sync_shared_state()
+
+    if render:
+        full_screen = pygame.Surface((game.WINDOW_WIDTH, game.WINDOW_HEIGHT)).convert()
+        dirty_screen = pygame.Surface((game.WINDOW_WIDTH, game.WINDOW_HEIGHT)).convert()
+        renderer = DirtyRenderer(dirty_screen)
+        background = pygame.Surface(full_screen.get_size()).convert()
+        background.fill(pygame.Color(0, 0, 0))
+
+    times = dict((name, []) for name in ('ai', 'update', 'sync', 'effects_update', 'effects_draw', 'render_full', 'render_dirty'))
+    effects = []
+    for i in range(ticks):
+        scenario.tick()
+        sim.process_input()
+        start = monotonic()
+        for stepper in sim.steppers:
+            if not isinstance(stepper, simulation.JasonAI) or sim.ticks % 3 == 2:
+                stepper.step()
+        times['ai'].append(monotonic() - start)
+
+        start = monotonic()
+        game.update()
+        times['update'].append(monotonic() - start)
+
+        start = monotonic()
+        game.sync_shared_state()
+        times['sync'].append(monotonic() - start)
+        sim.ticks += 1
+
+        if not render:
+            continue
+        effects.append(len(game.effects))
+
+        start = monotonic()
+        game.update_effects()
+        times['effects_update'].append(monotonic() - start)
+
+        game.viewport.update()
+        game.screen = full_screen
+        start = monotonic()
+        full_screen.blit(background, (0, 0))
+        game.draw()
+        times['render_full'].append(monotonic() - start)
+        start = monotonic()
+        for effect in game.effects:
+            effect.draw()
+        times['effects_draw'].append(monotonic() - start)
+
+        game.screen = dirty_screen
+        start = monotonic()
+        renderer.draw()
+        times['render_dirty'].append(monotonic() - start)
+
+    results = {}
+    for name, values in times.items():
+        if values:
+            results[name] = summarize([value * 1000 for value in values])
+    if effects:
+        results['effects_count'] = summarize(effects)
+    results['ticks_per_second'] = ticks / max(sum(times['update']), 1e-9)
+
+    # Each AI class's decisions, pooled over its players
+    decisions = {}
+    for proc in sim.ai_processes:
+        decisions.setdefault(type(proc).__name__, []).extend(proc.stats.columns['execute_ms'].values().tolist())
+    for name, values in decisions.items():
+        if values:
+            results['ai_' + name] = summarize(values)
+    sim.stop()
+    return results
+
+def benchmark(level_files, scenario_classes, ticks, seed, render=True, snake_counts=(None,), batch_size=None):
+    """ Runs every scenario on every level, once for each of
+        _snake_counts_ (None being the AI Demo's line-up). Returns the JSON
+        document. """
+    if render:
+        pygame.display.init()
+        game.init_display()
+    results = {}
+    for level_file in level_files:
+        for scenario_class in scenario_classes:
+            for snakes in snake_counts:
+                key = '%s/%s' % (os.path.splitext(os.path.basename(level_file))[0], scenario_class.name)
+                if snakes:
+                    key += '/%d_snakes' % snakes
+                print >>sys.stderr, "%s..." % key
+                results[key] = run(level_file, scenario_class, ticks, seed, render, snakes, batch_size)
+    return {
+        'ticks': ticks,
+        'seed': seed,
+        'batch_size': batch_size,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'pygame': pygame.version.ver,
+        'results': results,
+    }
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """ Prints the p50 and p95 of every timing in both documents side by side.
+        Returns the (key, measurement, statistic) of each that got more than
+        _threshold_ percent (and NOISE_MS) slower, which are also marked with
+        a '<'. """
+    regressions = []
+    print "%-28s %-18s %-4s %10s %10s %8s" % ('Scenario', 'Measurement', '', 'Baseline', 'Current', 'Change')
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        before, after = baseline['results'][key], current['results'][key]
+        for name in sorted(set(before) & set(after)):
+            if name == 'ticks_per_second':
+                # Higher is better
+                change = (after[name] / max(before[name], 1e-9) - 1) * 100
+                flag = ' <' if change < -threshold else ''
+                print "%-28s %-18s %-4s %10.0f %10.0f %+7.1f%%%s" % (key, name, '', before[name], after[name], change, flag)
+                if flag:
+                    regressions.append((key, name, ''))
+                continue
+            if name == 'effects_count':
+                continue
+            for statistic in ('p50', 'p95'):
+                old, new = before[name][statistic], after[name][statistic]
+                change = (new / max(old, 1e-9) - 1) * 100
+                flag = ' <' if change > threshold and new - old > NOISE_MS else ''
+                print "%-28s %-18s %-4s %10.3f %10.3f %+7.1f%%%s" % (key, name, statistic, old, new, change, flag)
+                if flag:
+                    regressions.append((key, name, statistic))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game loop on fixed scenarios.")
+    parser.add_argument('levels', nargs='*', help="Level files (default: all of levels/)")
+    parser.add_argument('--scenario', action='append', choices=[_class.name for _class in SCENARIOS], help="Scenario to run (default: all)")
+    parser.add_argument('--ticks', type=int, default=300, help="Ticks to play per level and scenario")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the levels and scenarios")
+    parser.add_argument('--no-render', action='store_true', help="Skip the effects and rendering measurements")
+    parser.add_argument('--snakes', type=int, action='append', help="Run with this many AI snakes instead of the AI Demo's four (repeatable)")
+    parser.add_argument('--batch-size', type=int, help="Step the AIs in batches of this many, sharing one copy of the state")
+    parser.add_argument('--output', help="Write the results to this file instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Compare two result files instead of running")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="Percent slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print "%d measurements regressed by more than %.0f%%" % (len(regressions), args.threshold)
+            sys.exit(1)
+        return
+
+    level_files = args.levels or sorted(os.path.join('levels', f) for f in os.listdir('levels'))
+    scenario_classes = [SCENARIO_CLASSES[name] for name in args.scenario] if args.scenario else SCENARIOS
+    # The AIs print to stdout now and then; keep that out of the JSON
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        document = benchmark(level_files, scenario_classes, args.ticks, args.seed, not args.no_render, args.snakes or (None,), args.batch_size)
+    finally:
+        sys.stdout = stdout
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import random
+
+import numpy
+
+# Cell types stored in Board.cells
+EMPTY, WALL, INDESTRUCTABLE_WALL, APPLE, SNAKE, MISSILE = range(6)
+
+# Character used for each cell type in the board shared with AI processes
+CELL_CHARS = [' ', 'W', 'I', 'A', 'S', 'M']
+_CELL_CHAR_ARRAY = numpy.array(CELL_CHARS)
+_CELL_CHAR_CODES = numpy.array([ord(c) for c in CELL_CHARS], dtype=numpy.uint8)
+
+# Cells a snake can't move through, for distance fields
+OBSTACLES = (WALL, INDESTRUCTABLE_WALL, SNAKE)
+_neighbor_tables = {}
+
+def get_neighbor_table(width, height):
+    """ Returns a (width*height, 4) array of each flat cell index's wrapped
+        neighbours, in LEFT, RIGHT, UP, DOWN order. """
+    table = _neighbor_tables.get((width, height))
+    if table is None:
+        x, y = numpy.divmod(numpy.arange(width*height), height)
+        table = numpy.column_stack((
+            ((x - 1) % width)*height + y,
+            ((x + 1) % width)*height + y,
+            x*height + (y - 1) % height,
+            x*height + (y + 1) % height))
+        _neighbor_tables[width, height] = table
+    return table
+
+class CollisionError(Exception):
+    def __init__(self, collider, collidee):
+        self.collider = collider
+        self.collidee = collidee
+
+class Board(object):
+    """ Array-backed game board.
+
+        _cells_ holds the type of whatever occupies each cell and _ids_ the
+        entity id of that object, which _objects_ maps back to the object
+        itself. Both arrays are indexed [x, y], so AIs can read the board
+        with plain (or vectorized) numpy indexing.
+
+        Cells changed since the last take_dirty() are collected in _dirty_
+        (as flat x*height+y indices), so the snapshot shared with AI
+        processes only copies those.
+
+        Empty cells are kept in a free-cell index (a list of flat indices plus
+        each cell's position in that list), so a random empty cell can be
+        picked, claimed and released in constant time. """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = numpy.zeros((width, height), dtype=numpy.int8)
+        self.ids = numpy.zeros((width, height), dtype=numpy.int32)
+        self.objects = {}
+        self.dirty = set()
+        self._next_id = 1
+        self._free_cells = None
+        self._free_positions = None
+        self.rebuild_free_cells()
+
+    def get(self, x, y):
+        """ Returns the object at (x, y), or None if the cell is empty. """
+        entity_id = self.ids[x, y]
+        if entity_id:
+            return self.objects[entity_id]
+        return None
+
+    def get_type(self, x, y):
+        return self.cells[x, y]
+
+    def is_empty(self, x, y):
+        return not self.cells[x, y]
+
+    def place(self, x, y, obj):
+        """ Puts _obj_ at (x, y). Raises CollisionError if the cell is taken. """
+        if self.cells[x, y]:
+            raise CollisionError(obj, self.get(x, y))
+
+        entity_id = getattr(obj, 'entity_id', None)
+        if entity_id is None:
+            entity_id = obj.entity_id = self._next_id
+            self._next_id += 1
+        self.cells[x, y] = obj.cell_type
+        self.ids[x, y] = entity_id
+        self.objects[entity_id] = obj
+        index = x*self.height + y
+        self.dirty.add(index)
+        if self._free_cells is not None:
+            self._claim_free_cell(index)
+
+    def clear(self, x, y):
+        entity_id = self.ids[x, y]
+        if not entity_id:
+            return
+        del self.objects[entity_id]
+        self.cells[x, y] = EMPTY
+        self.ids[x, y] = 0
+        index = x*self.height + y
+        self.dirty.add(index)
+        if self._free_cells is not None:
+            self._release_free_cell(index)
+
+    def move_many(self, old_indices, new_indices):
+        """ Moves the objects in the flat cells _old_indices_ to _new_indices_
+            in one go. The new cells must be empty and distinct, and none of
+            them may be one of the old cells. """
+        cells = self.cells.ravel()
+        ids = self.ids.ravel()
+        types = cells[old_indices]
+        entity_ids = ids[old_indices]
+        cells[old_indices] = EMPTY
+        ids[old_indices] = 0
+        cells[new_indices] = types
+        ids[new_indices] = entity_ids
+
+        old_indices = old_indices.tolist()
+        new_indices = new_indices.tolist()
+        self.dirty.update(old_indices)
+        self.dirty.update(new_indices)
+        if self._free_cells is not None:
+            # Each move frees one cell and claims another, so the freed cell
+            # simply takes over the claimed cell's slot in the index.
+            free_cells = self._free_cells
+            free_positions = self._free_positions
+            for old, new in zip(old_indices, new_indices):
+                position = free_positions[new]
+                free_cells[position] = old
+                free_positions[old] = position
+                free_positions[new] = -1
+
+    def _claim_free_cell(self, index):
+        # Swap the last free cell into the claimed cell's slot
+        position = self._free_positions[index]
+        last = self._free_cells.pop()
+        if last != index:
+            self._free_cells[position] = last
+            self._free_positions[last] = position
+        self._free_positions[index] = -1
+
+    def _release_free_cell(self, index):
+        self._free_positions[index] = len(self._free_cells)
+        self._free_cells.append(index)
+
+    def suspend_free_cells(self):
+        """ Stops maintaining the free-cell index, e.g. while a level is being
+            laid out. Call rebuild_free_cells() when done. """
+        self._free_cells = None
+        self._free_positions = None
+
+    def rebuild_free_cells(self):
+        """ Rebuilds the free-cell index from the cell grid in bulk. """
+        free_cells = numpy.flatnonzero(self.cells.ravel() == EMPTY)
+        positions = numpy.empty(self.cells.size, dtype=numpy.intp)
+        positions.fill(-1)
+        positions[free_cells] = numpy.arange(len(free_cells))
+        self._free_cells = free_cells.tolist()
+        self._free_positions = positions.tolist()
+
+    def count_free_cells(self):
+        return len(self._free_cells)
+
+    def random_free_cell(self, rng=random):
+        """ Returns the coordinates of an empty cell picked uniformly at
+            random, or None if the board is full. """
+        if not self._free_cells:
+            return None
+        index = self._free_cells[rng.randrange(len(self._free_cells))]
+        return divmod(index, self.height)
+
+    def distance_field(self, sources, obstacles=OBSTACLES, max_distance=None, out=None):
+        """ Breadth-first search from all _sources_ (flat indices) at once
+            over the wrapped board. Returns a flat int32 array with the number
+            of steps from each cell to the nearest source, or -1 where no
+            source can be reached (within _max_distance_ steps, if given).
+            Obstacle cells get no distance of their own, but sources always
+            count as reachable.
+
+            Each BFS layer is expanded with a few numpy operations on just
+            the layer's cells, so besides setting up this costs O(cells
+            reached) in C plus O(max distance) in Python. """
+        if out is None:
+            out = numpy.empty(self.cells.size, dtype=numpy.int32)
+        out.fill(-1)
+        sources = numpy.asarray(sources, dtype=numpy.intp)
+        if not len(sources):
+            return out
+
+        neighbors = get_neighbor_table(self.width, self.height)
+        unvisited = ~numpy.in1d(numpy.arange(MISSILE + 1), obstacles)[self.cells.ravel()]
+        unvisited[sources] = False
+        out[sources] = 0
+        frontier = sources
+        distance = 0
+        owner = numpy.empty(self.cells.size, dtype=numpy.intp)
+        while len(frontier) and distance != max_distance:
+            distance += 1
+            candidates = neighbors[frontier].ravel()
+            candidates = candidates[unvisited[candidates]]
+            # Cells reached from several frontier cells are listed more than
+            # once; keep the copy whose position was stored last
+            order = numpy.arange(len(candidates))
+            owner[candidates] = order
+            frontier = candidates[owner[candidates] == order]
+            unvisited[frontier] = False
+            out[frontier] = distance
+        return out
+
+    def reach_fields(self, sources, max_distance, reach, owner, rival, obstacles=OBSTACLES):
+        """ Breadth-first search from each of _sources_ (flat indices, or -1
+            to skip one) on its own over the wrapped board, up to
+            _max_distance_ steps, with the same rules as distance_field().
+            Fills the flat int32 arrays _reach_ with the fewest steps any
+            source needs to each cell, _owner_ with the position in
+            _sources_ of that source, and _rival_ with the fewest steps any
+            other source needs; all -1 where no source gets within range.
+
+            The searches advance together, one layer of (source, cell) pairs
+            at a time, so this costs O(cells reached by all sources) plus a
+            few passes over the board, however many sources there are. """
+        reach.fill(-1)
+        owner.fill(-1)
+        rival.fill(-1)
+        sources = numpy.asarray(sources, dtype=numpy.intp)
+        owners = numpy.flatnonzero(sources >= 0)
+        if not len(owners):
+            return
+
+        size = self.cells.size
+        neighbors = get_neighbor_table(self.width, self.height)
+        passable = ~numpy.in1d(numpy.arange(MISSILE + 1), obstacles)[self.cells.ravel()]
+        # Each search's visits are keyed source*size + cell. A layer's
+        # neighbours can only be in that layer or the ones either side of
+        # it, so only the last two layers need checking for visits.
+        frontier = owners*size + sources[owners]
+        previous = frontier[:0]
+        keys = [frontier]
+        distances = [numpy.zeros(len(frontier), dtype=numpy.int32)]
+        distance = 0
+        while len(frontier) and distance != max_distance:
+            distance += 1
+            searches, cells = numpy.divmod(frontier, size)
+            candidates = numpy.repeat(searches, 4)*size + neighbors[cells].ravel()
+            candidates = numpy.unique(candidates[passable[candidates % size]])
+            visited = numpy.concatenate((previous, frontier))
+            previous = frontier
+            frontier = candidates[~numpy.in1d(candidates, visited, assume_unique=True)]
+            keys.append(frontier)
+            distances.append(numpy.empty(len(frontier), dtype=numpy.int32))
+            distances[-1].fill(distance)
+
+        # Sort the visits by cell, then distance; the first of each cell is
+        # the nearest source, the first by any other source its rival
+        searches, cells = numpy.divmod(numpy.concatenate(keys), size)
+        distances = numpy.concatenate(distances)
+        order = numpy.lexsort((distances, cells))
+        searches, cells, distances = searches[order], cells[order], distances[order]
+        first = numpy.ones(len(cells), dtype=bool)
+        first[1:] = cells[1:] != cells[:-1]
+        reach[cells[first]] = distances[first]
+        owner[cells[first]] = searches[first]
+        others = searches != owner[cells]
+        cells, distances = cells[others], distances[others]
+        first = numpy.ones(len(cells), dtype=bool)
+        first[1:] = cells[1:] != cells[:-1]
+        rival[cells[first]] = distances[first]
+
+    def copy(self):
+        """ Returns a detached copy, e.g. for AIs that want to search ahead. """
+        board = Board(self.width, self.height)
+        board.cells = self.cells.copy()
+        board.ids = self.ids.copy()
+        board.objects = self.objects.copy()
+        board._next_id = self._next_id
+        board.rebuild_free_cells()
+        return board
+
+    def to_chars(self):
+        """ Returns the board as a [x][y] array of characters. """
+        return _CELL_CHAR_ARRAY[self.cells]
+
+    def take_dirty(self):
+        """ Returns the set of cells changed since the last call. """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def write_chars(self, out, indices=None):
+        """ Writes the cells' characters (see CELL_CHARS) into _out_, a flat
+            uint8 array laid out like _cells_; only at the flat _indices_ if
+            given, which costs O(changes) rather than O(board size). """
+        if indices is None:
+            out[:] = _CELL_CHAR_CODES[self.cells.ravel()]
+        else:
+            out[indices] = _CELL_CHAR_CODES[self.cells.ravel()[indices]]
@@ -0,0 +1,57 @@
+""" Font registry and rendered text cache.
+
+    Fonts are looked up by name in FONTS and loaded once; rendered text is kept
+    in a small LRU cache keyed by (font, text, color), so text that doesn't
+    change between frames (scores, the timer, the log, the win screen) is
+    just blitted instead of being rendered again.
+"""
+from collections import OrderedDict
+
+import pygame
+
+# name: (SysFont name, size, bold)
+FONTS = {
+    'menu': ("verdana", 30, False),
+    'menu_title': ("impact", 70, False),
+    'menu_subtitle': ("georgia", 15, False),
+    'score': ("impact", 30, False),
+    'timer': ("impact", 24, False),
+    'win_title': ("impact", 100, False),
+    'win_subtitle': ("verdana", 15, False),
+    'win_header': ("arial", 16, True),
+    'win_total': ("arial", 14, True),
+    'win_detail': ("arial", 13, False),
+    'log': ("verdana", 12, False),
+    'profiler': ("couriernew", 12, False),
+}
+CACHE_SIZE = 256
+
+_fonts = {}
+_rendered = OrderedDict()
+
+def load_fonts():
+    """ Loads every registered font up front, so the first frames don't
+        stall on SysFont lookups. """
+    for name in FONTS:
+        get_font(name)
+
+def get_font(name):
+    font = _fonts.get(name)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        sys_name, size, bold = FONTS[name]
+        font = _fonts[name] = pygame.font.SysFont(sys_name, size, bold=bold)
+    return font
+
+def render(name, text, color):
+    """ Returns _text_ rendered antialiased in the font registered as _name_.
+        The surface is shared with later callers, so don't draw on it. """
+    key = (name, text, tuple(color))
+    surface = _rendered.pop(key, None)
+    if surface is None:
+        surface = get_font(name).render(text, 1, color)
+        if len(_rendered) >= CACHE_SIZE:
+            _rendered.popitem(last=False)
+    _rendered[key] = surface
+    return surface
@@ -1,24 +1,32 @@
 import ConfigParser
-import multiprocessing
-from ctypes import c_char
-from random import randrange, randint
+import random
+from random import randint
 
+import numpy
 import pygame
 from pygame.locals import *
+from board import Board, CollisionError, WALL, INDESTRUCTABLE_WALL, SNAKE, MISSILE
 import game_objects
 import game_effects
-import process
-serializer = process.Serializer()
+import snapshot
+from viewport import Viewport
 
 NAME = "Battle Snake %i" % (randint(3, 9) * 1000)  # Choose a random futuristic-looking year :)
 WINDOW_WIDTH = 1280
 WINDOW_HEIGHT = 800
 SCOREBOARD_HEIGHT = 80
-BOARD_WIDTH = 80
-BOARD_HEIGHT = 45
-CELL_WIDTH = WINDOW_WIDTH / BOARD_WIDTH
-CELL_HEIGHT = (WINDOW_HEIGHT-SCOREBOARD_HEIGHT) / BOARD_HEIGHT
+CELL_WIDTH = 16
+CELL_HEIGHT = 16
+VIEW_WIDTH = WINDOW_WIDTH / CELL_WIDTH  # Cells that fit the window
+VIEW_HEIGHT = (WINDOW_HEIGHT-SCOREBOARD_HEIGHT) / CELL_HEIGHT
+BOARD_WIDTH = VIEW_WIDTH  # Set from the level by init_level()
+BOARD_HEIGHT = VIEW_HEIGHT
 LEFT, RIGHT, UP, DOWN = range(4)
+DANGER_TICKS = 6  # How far ahead missiles are traced for the AIs
+DANGER_MOVES = 5  # How far ahead snake heads are traced for the AIs
+
+# Cell types draw() draws from the board, in order
+DRAW_ORDER = ((WALL, INDESTRUCTABLE_WALL), (MISSILE,), (SNAKE,))
 
 player_controls = {
     0: [K_LEFT, K_RIGHT, K_UP, K_DOWN],
@@ -36,10 +44,21 @@ level = None
 #     '4': pygame.Color(0, 128, 128),
 # }
 
+headless = False  # Set by the simulation to run the rules without a display
+screen = None
+
+# Game rules only draw from _rng_, and effects from their own generator, so a
+# seed plus the recorded inputs always reproduce the same match.
+rng = random.Random()
+effects_rng = random.Random()
+match_seed = None
+tick = 0  # Number of updates since the level was loaded
+recorder = None  # Set to a replay.Recorder to log player input
+
 players = []
 apples = []
 walls = []
-missiles = []
+missiles = game_objects.Missiles()
 effects = []
 log_screen = game_objects.LogScreen()
 
@@ -48,77 +67,204 @@ config = ConfigParser.SafeConfigParser()
 config.read('snake.ini')
 config.read('local.ini')
 
-# Set frame rate
-frames_per_second = config.getint('snake', 'frames_per_second')
-
-# Set full screen mode
-flags = 0
-if config.getboolean('snake', 'full_screen'):
-    flags |= pygame.FULLSCREEN
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), flags)
+# Set frame and tick rates
+frames_per_second = config.getint('snake', 'frames_per_second')  # Rendering, at most
+ticks_per_second = config.getint('snake', 'ticks_per_second')  # Game updates
 
 ai_index = config.getint('snake', 'ai_index')
 use_multiprocessing= config.getboolean('snake', 'use_multiprocessing')
+record_replays = config.getboolean('snake', 'record_replays')
+dirty_rendering = config.getboolean('snake', 'dirty_rendering')
+ai_stats = config.getboolean('snake', 'ai_stats')
+frame_profiler = config.getboolean('snake', 'frame_profiler')
+arena_snakes = config.getint('snake', 'arena_snakes')  # AI snakes in the "Arena" game mode
+ai_batch_size = config.getint('snake', 'ai_batch_size')  # AIs stepped together on one copy of the state
+
+board = Board(BOARD_WIDTH, BOARD_HEIGHT)
+viewport = Viewport(BOARD_WIDTH, BOARD_HEIGHT)
+
+# Distance from every cell to the nearest apple (-1 where none can be reached),
+# flat like board.Board's grids. Computed once per tick for all AIs.
+apple_distances = numpy.empty(BOARD_WIDTH * BOARD_HEIGHT, dtype=numpy.int32)
 
-class CollisionError(Exception):
-    def __init__(self, collider, collidee):
-        self.collider = collider
-        self.collidee = collidee
+# Danger map for the AIs: ticks until a missile enters each cell (-1 if not
+# within DANGER_TICKS), the fewest moves any snake head needs to reach each
+# cell, the index of the player whose head that is, and the fewest moves
+# any other player's head needs (all -1 if not within DANGER_MOVES). Three
+# maps whatever the number of players, rather than one per player.
+missile_ticks = numpy.empty(BOARD_WIDTH * BOARD_HEIGHT, dtype=numpy.int32)
+head_reach = numpy.empty(BOARD_WIDTH * BOARD_HEIGHT, dtype=numpy.int32)
+head_owner = numpy.empty(BOARD_WIDTH * BOARD_HEIGHT, dtype=numpy.int32)
+rival_reach = numpy.empty(BOARD_WIDTH * BOARD_HEIGHT, dtype=numpy.int32)
 
-class BoardRow(list):
-    def __setitem__(self, key, value):
-        if value and self.__getitem__(key):
-            raise CollisionError(value, self.__getitem__(key))
-        super(BoardRow, self).__setitem__(key, value)
-        shared_board[board.index(self)][key] = serializer.translate_board_obj(value)
+# Game state published to AI processes once per tick
+shared_snapshot = None
 
-# Board in shared memory used by AI processes
-shared_board = multiprocessing.Array(c_char * BOARD_HEIGHT,
-        ((c_char * BOARD_HEIGHT) * BOARD_WIDTH)())
+def init_display():
+    global screen
 
-board = []
-for i in range(BOARD_WIDTH):
-    board.append(BoardRow([None,] * BOARD_HEIGHT))
+    # Set full screen mode
+    flags = 0
+    if config.getboolean('snake', 'full_screen'):
+        flags |= pygame.FULLSCREEN
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), flags)
+
+def seed(value=None):
+    """ Seeds the game's random generators. Picks a fresh seed when _value_
+        is None and returns the seed used. """
+    global match_seed
+    if value is None:
+        value = random.getrandbits(32)
+    match_seed = value
+    rng.seed(value)
+    effects_rng.seed(value)
+    return value
 
 def update():
-    for obj in apples + missiles:
-        obj.update()
+    global tick
+    tick += 1
+
+    for apple in apples:
+        apple.update()
+
+    missiles.update()
 
     for player in players:
         if not player.is_dead:
             player.update()
 
+def update_effects():
+    """ Updates all effects, then drops the finished ones in a single pass and
+        returns their particle buffers to the pool. """
+    global effects
+    for effect in effects:
+        effect.update()
+    for effect in effects:
+        if effect.is_finished:
+            effect.release()
+    effects = [effect for effect in effects if not effect.is_finished]
+
 def draw():
-    for drawable in apples + walls + missiles:
-        drawable.draw()
+    """ Draws what's in view: apples first since they spill into the cells
+        around them, then the walls, missiles and snakes on the visible
+        cells, then what isn't on the board. """
+    for apple in apples:
+        if viewport.is_visible(apple.x, apple.y):
+            apple.draw()
 
-    for player in players:
-        if not player.is_dead:
-            player.draw()
+    visible = viewport.indices.ravel()
+    cells = board.cells.ravel()[visible]
+    ids = board.ids.ravel()[visible]
+    objects = board.objects
+    for cell_types in DRAW_ORDER:
+        for entity_id in ids[numpy.in1d(cells, cell_types)].tolist():
+            objects[entity_id].draw()
+
+    for missile in missiles:
+        if missile.board_cell is None and viewport.is_visible(missile.x, missile.y):
+            missile.draw()
+    for part in get_off_board_parts():
+        if viewport.is_visible(part.x, part.y):
+            part.draw()
 
     log_screen.draw()
 
-def init_level():
-    global players, apples, walls, missiles, effects, board, log_screen
+def get_off_board_parts():
+    """ Snake parts draw() draws that aren't on the board: those of
+        invincible snakes, and the spawn part an invincible snake leaves
+        behind as its tail when it eats its way back onto the board. """
+    parts = []
+    for player in players:
+        if player.is_dead or not player.parts:
+            continue
+        if player.is_invincible:
+            if not player.is_invisible:
+                parts.extend(player.parts)
+        else:
+            tail = player.parts[0]
+            if board.ids[tail.x, tail.y] != getattr(tail, 'entity_id', None):
+                parts.append(tail)
+    return parts
+
+def set_board_size(width, height):
+    """ Sizes the board and the per-cell maps for a level. """
+    global BOARD_WIDTH, BOARD_HEIGHT, apple_distances, missile_ticks, head_reach, head_owner, rival_reach
+    if (width, height) == (BOARD_WIDTH, BOARD_HEIGHT):
+        return
+    BOARD_WIDTH, BOARD_HEIGHT = width, height
+    apple_distances = numpy.empty(width * height, dtype=numpy.int32)
+    missile_ticks = numpy.empty(width * height, dtype=numpy.int32)
+    head_reach = numpy.empty(width * height, dtype=numpy.int32)
+    head_owner = numpy.empty(width * height, dtype=numpy.int32)
+    rival_reach = numpy.empty(width * height, dtype=numpy.int32)
 
+def init_level(seed_value=None):
+    global players, apples, walls, missiles, effects, board, viewport, log_screen, tick
+
+    set_board_size(level.width, level.height)
     players = []
     apples = []
     walls = []
-    missiles = []
+    missiles = game_objects.Missiles()
     effects = []
-    board = []
+    board = Board(BOARD_WIDTH, BOARD_HEIGHT)
+    viewport = Viewport(BOARD_WIDTH, BOARD_HEIGHT)
     log_screen = game_objects.LogScreen()
-
-    for i in range(BOARD_WIDTH):
-        board.append(BoardRow([None,] * BOARD_HEIGHT))
+    tick = 0
+    seed(seed_value)
 
     # Load level
     level.parse_layout()
+    if players:
+        viewport.follow(players[0])
+
+def init_shared_state():
+    """ Create the snapshot shared with AI processes and publish the current
+        state in it. """
+    global shared_snapshot
+    shared_snapshot = snapshot.SharedSnapshot(BOARD_WIDTH, BOARD_HEIGHT, len(players), level.num_apples)
+    sync_shared_state()
+
+def sync_shared_state():
+    update_apple_distances()
+    update_danger_map()
+    shared_snapshot.publish(tick, board,
+            [((player.x, player.y), player.direction, player.get_length()) for player in players],
+            [(apple.x, apple.y) for apple in apples],
+            missiles, apple_distances, missile_ticks, head_reach, head_owner, rival_reach)
+
+def update_apple_distances():
+    """ Computes a breadth-first distance field from all apples around walls
+        and snakes, so AIs can read how far the nearest apple is from any cell
+        and follow it downhill instead of each searching for it. """
+    board.distance_field([apple.x*BOARD_HEIGHT + apple.y for apple in apples], out=apple_distances)
+
+def update_danger_map():
+    """ Computes where missiles will be and where snake heads can get to over
+        the next few ticks, so AIs can look up threats instead of each tracing
+        missiles and enemies on their own. """
+    missile_ticks[:] = missiles.get_arrival_ticks(DANGER_TICKS)
+    heads = [-1 if player.is_dead else player.x*BOARD_HEIGHT + player.y for player in players]
+    board.reach_fields(heads, DANGER_MOVES, head_reach, head_owner, rival_reach)
+
+def apply_commands(commands):
+    """ Steers players by the (player index, direction) pairs AIs send, in
+        order. """
+    for player_index, direction in commands:
+        players[player_index].set_direction(direction)
+
+def get_winners():
+    """ Returns the players that reached the kill goal, ties broken by the
+        fewest deaths. """
+    winners = filter(lambda p: len(p.kills) >= level.kills_to_win, players)
+    if winners:
+        least_deaths = min(len(w.deaths) for w in winners)
+        winners = filter(lambda w: len(w.deaths) == least_deaths, winners)
+    return winners
 
 def add_apple():
-    try:
-        a = game_objects.Apple(randrange(BOARD_WIDTH), randrange(BOARD_HEIGHT))
-    except CollisionError, ce:
-        add_apple()
-    else:
-        apples.append(a)
+    cell = board.random_free_cell(rng)
+    if cell is None:
+        # No room left on the board
+        return
+    apples.append(game_objects.Apple(*cell))
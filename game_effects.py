@@ -1,15 +1,38 @@
+import numpy
 import pygame
 import game
-import random
+
+ALPHA_STEP = 8  # Sprites are cached per alpha bucket of this size
+_sprites = {}
+_buffer_pool = []
+
+def get_sprite(shape, size, color, width=0):
+    """ Returns a cached SRCALPHA surface of a circle (_size_ is the radius)
+        or a square (_size_ is the side) in _color_. Alpha is rounded down to
+        a multiple of ALPHA_STEP so fading particles share a few sprites. """
+    alpha = color[3] - color[3] % ALPHA_STEP if len(color) > 3 else 255
+    key = (shape, size, color[0], color[1], color[2], alpha, width)
+    sprite = _sprites.get(key)
+    if sprite is None:
+        rgba = (color[0], color[1], color[2], alpha)
+        if shape == "circle":
+            sprite = pygame.Surface((size*2, size*2), pygame.SRCALPHA, 32)
+            pygame.draw.circle(sprite, rgba, (size, size), size, width)
+        else:
+            sprite = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+            pygame.draw.rect(sprite, rgba, pygame.Rect(0, 0, size, size), width)
+        _sprites[key] = sprite
+    return sprite
 
 def draw_circle(screen, color, (center_x, center_y), radius, width):
     """Handles alpha transparency"""
-    image = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA, 32)
-    pygame.draw.circle(image, color, (radius, radius), radius, width)
-    screen.blit(image, (center_x-radius, center_y-radius))
+    screen.blit(get_sprite("circle", radius, color, width), (center_x-radius, center_y-radius))
 
 def draw_rect(screen, color, rect, width=0):
     """Handles alpha transparency"""
+    if rect.width == rect.height:
+        screen.blit(get_sprite("rect", rect.width, color, width), (rect.left, rect.top))
+        return
     image = pygame.Surface((rect.width, rect.height), pygame.SRCALPHA, 32)
     pygame.draw.rect(image, color, pygame.Rect(0, 0, rect.width, rect.height), width)
     screen.blit(image, (rect.left, rect.top))
@@ -27,10 +50,73 @@ def adjust_brightness(color, multiplier):
             rgb[i] = 0
     return pygame.Color(rgb[0], rgb[1], rgb[2], color.a)
 
+def add_explosion(x, y, color, **kwargs):
+    """ Shows an explosion, unless the game is running without a display. """
+    if game.headless:
+        return
+    game.effects.append(Explosion(x, y, color, **kwargs))
+
+class ParticleBuffer(object):
+    """ Preallocated particle state: position, velocity and alpha in parallel
+        numpy arrays, the first _count_ entries being live particles. """
+    def __init__(self, capacity=32):
+        self.x = numpy.zeros(capacity)
+        self.y = numpy.zeros(capacity)
+        self.vx = numpy.zeros(capacity)
+        self.vy = numpy.zeros(capacity)
+        self.alpha = numpy.zeros(capacity)
+        self.count = 0
+
+    def _grow(self):
+        for name in ('x', 'y', 'vx', 'vy', 'alpha'):
+            array = getattr(self, name)
+            setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+
+    def add(self, x, y, vx, vy, alpha):
+        if self.count == len(self.x):
+            self._grow()
+        i = self.count
+        self.x[i], self.y[i], self.vx[i], self.vy[i], self.alpha[i] = x, y, vx, vy, alpha
+        self.count += 1
+
+    def move(self):
+        n = self.count
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+
+    def fade(self, amount):
+        """ Lowers every particle's alpha, dropping those that would fade out. """
+        n = self.count
+        alive = self.alpha[:n] >= amount
+        if not alive.all():
+            n = self.count = int(alive.sum())
+            for array in (self.x, self.y, self.vx, self.vy, self.alpha):
+                array[:n] = array[:len(alive)][alive]
+        self.alpha[:n] -= amount
+
+    def get_bounding_rect(self, size):
+        """ Rect covering every particle, padded by _size_ on each side. """
+        n = self.count
+        if not n:
+            return None
+        left = int(self.x[:n].min()) - size
+        top = int(self.y[:n].min()) - size
+        return pygame.Rect(left, top, int(self.x[:n].max()) + size - left + 1, int(self.y[:n].max()) + size - top + 1)
+
+def acquire_buffer():
+    """ Takes a particle buffer from the pool, or makes a new one. """
+    if _buffer_pool:
+        return _buffer_pool.pop()
+    return ParticleBuffer()
+
+def release_buffer(buffer):
+    buffer.count = 0
+    _buffer_pool.append(buffer)
+
 class Explosion(object):
     def __init__(self, x, y, color, max_speed=15, num_particles=20, particle_size=3, fade_speed=6, particle_type="circle"):
-        self.particles = []  # Each particle holds [x, y, x_speed, y_speed]
-        self.num_particles = num_particles        
+        self.particles = acquire_buffer()
+        self.num_particles = num_particles
         self.particle_size = particle_size
         self.particle_type = particle_type
         self.max_speed = max_speed
@@ -38,60 +124,87 @@ class Explosion(object):
         self.y = y
         self.color = clone_color(color)
         self.fade_speed = fade_speed
+        self.is_finished = False
 
+        uniform = game.effects_rng.uniform
         for i in range(self.num_particles):
-            self.particles.append([float(self.x), float(self.y), random.uniform(-self.max_speed, self.max_speed), random.uniform(-self.max_speed, self.max_speed)])
+            self.particles.add(float(self.x), float(self.y), uniform(-self.max_speed, self.max_speed), uniform(-self.max_speed, self.max_speed), 0)
 
     def draw(self):
-        for p in self.particles:
-            if self.particle_type == "rect":
-                draw_rect(game.screen, self.color, pygame.Rect(p[0], p[1], self.particle_size, self.particle_size))
-            else:
-                draw_circle(game.screen, self.color, (int(p[0]), int(p[1])), self.particle_size, 0)
+        n = self.particles.count
+        shift_x, shift_y = game.viewport.shift(self.x, self.y)
+        if self.particle_type == "rect":
+            sprite = get_sprite("rect", self.particle_size, self.color)
+            xs = self.particles.x[:n].astype(int) + shift_x
+            ys = self.particles.y[:n].astype(int) + shift_y
+        else:
+            sprite = get_sprite("circle", self.particle_size, self.color)
+            xs = self.particles.x[:n].astype(int) - self.particle_size + shift_x
+            ys = self.particles.y[:n].astype(int) - self.particle_size + shift_y
+        game.screen.blits([(sprite, position) for position in zip(xs.tolist(), ys.tolist())], 0)
 
     def update(self):
-        for p in self.particles:
-            p[0] += p[2]
-            p[1] += p[3]
+        self.particles.move()
 
         # Decrease alpha of particle
         if self.color.a < self.fade_speed:
-            game.effects.remove(self)
+            self.is_finished = True
         else:
             self.color.a -= self.fade_speed
 
+    def get_bounding_rect(self):
+        """ Screen area covered by the particles, or None if there are none. """
+        rect = self.particles.get_bounding_rect(self.particle_size * 2)
+        if rect is not None:
+            rect.move_ip(game.viewport.shift(self.x, self.y))
+        return rect
+
+    def release(self):
+        release_buffer(self.particles)
+        self.particles = None
+
 class ParticleTrail(object):
     def __init__(self, followed_object, color):
         self.followed_object = followed_object
         self.color = clone_color(color)
         self.trail_density = 1
-        self.particles = []
+        self.particles = acquire_buffer()
         self.particle_radius = 2
         self.particle_speed = 2
         self.fade_speed = 10
+        self.is_finished = False  # Set once the followed object is gone
+        self.anchor = followed_object.rect.center  # Where the latest particle started
 
     def draw(self):
-        for particle in self.particles:
-            draw_circle(game.screen, particle['color'], (particle['x'], particle['y']), self.particle_radius, 0)
+        n = self.particles.count
+        r = self.particle_radius
+        rgb = (self.color.r, self.color.g, self.color.b)
+        shift_x, shift_y = game.viewport.shift(*self.anchor)
+        positions = zip((self.particles.x[:n].astype(int) - r + shift_x).tolist(), (self.particles.y[:n].astype(int) - r + shift_y).tolist())
+        alphas = self.particles.alpha[:n].astype(int).tolist()
+        game.screen.blits([(get_sprite("circle", r, rgb + (alpha,)), position) for position, alpha in zip(positions, alphas)], 0)
 
     def update(self):
+        center = self.anchor = self.followed_object.rect.center
+        uniform = game.effects_rng.uniform
         for i in range(self.trail_density):
-            self.particles.append({
-                "x": self.followed_object.rect.centerx, 
-                "y": self.followed_object.rect.centery, 
-                "vx": random.uniform(-self.particle_speed, self.particle_speed), 
-                "vy": random.uniform(-self.particle_speed, self.particle_speed), 
-                "color": clone_color(self.color)
-                })
-
-        for particle in self.particles:
-            particle['x'] += particle['vx']
-            particle['y'] += particle['vy']
-
-            if particle['color'].a < self.fade_speed:
-                self.particles.remove(particle)
-            else:
-                particle['color'].a -= self.fade_speed
+            self.particles.add(center[0], center[1],
+                uniform(-self.particle_speed, self.particle_speed),
+                uniform(-self.particle_speed, self.particle_speed),
+                self.color.a)
+
+        self.particles.move()
+        self.particles.fade(self.fade_speed)
+
+    def get_bounding_rect(self):
+        rect = self.particles.get_bounding_rect(self.particle_radius * 2)
+        if rect is not None:
+            rect.move_ip(game.viewport.shift(*self.anchor))
+        return rect
+
+    def release(self):
+        release_buffer(self.particles)
+        self.particles = None
 
 # class FadingText(object):
 #     def __init__(self, text, x, y, color):
@@ -1,30 +1,49 @@
 from collections import deque
+import numpy
 import pygame
+import board
+import fonts
 import game
 import game_effects
 import time
 
 class GameObject(object):
+    cell_type = None
+
     def __init__(self, x, y, color):
         self.x = x
         self.y = y
-        self.width = game.CELL_WIDTH
-        self.height = game.CELL_HEIGHT
-        self.rect = pygame.Rect(x*self.width, y*self.height, self.width, self.height)
         self.color = color
 
-        game.board[x][y] = self
+        game.board.place(x, y, self)
+
+    @property
+    def width(self):
+        return game.CELL_WIDTH
+
+    @property
+    def height(self):
+        return game.CELL_HEIGHT
+
+    @property
+    def rect(self):
+        """ Area on the whole board, in pixels. Built on demand so moving
+            objects don't have to keep a Rect up to date while the game runs
+            headless. """
+        return pygame.Rect(self.x*self.width, self.y*self.height, self.width, self.height)
 
     def draw(self):
-        pygame.draw.rect(game.screen, self.color, self.rect)
+        pygame.draw.rect(game.screen, self.color, game.viewport.cell_rect(self.x, self.y))
 
     def update(self):
         raise NotImplementedError('Not implemented')
 
     def remove_from_board(self):
-        game.board[self.x][self.y] = None
+        game.board.clear(self.x, self.y)
 
 class SnakePart(GameObject):
+    cell_type = board.SNAKE
+
     def __init__(self, player, x, y, color):
         super(SnakePart, self).__init__(x, y, color)
         self.player = player
@@ -55,68 +74,206 @@ class SnakePart(GameObject):
         return Missile(self.player, x, y, direction, self.color)
 
 class Missile(GameObject):
+    """ Handle for a missile in flight. Its position lives in the game.missiles
+        arrays; the handle is what the board, AIs and the death log refer to. """
+    cell_type = board.MISSILE
+
     def __init__(self, player, x, y, direction, color):
-        super(Missile, self).__init__(x, y, game_effects.adjust_brightness(color, 0.5))
         self.player = player
         self.direction = direction
-        self.particle_trail = game_effects.ParticleTrail(self, self.color)
-        game.effects.append(self.particle_trail)
+        self.color = game_effects.adjust_brightness(color, 0.5)
+        self.slot = None  # Index into the game.missiles arrays while in flight
+        self.board_cell = None  # Cell the missile occupies on the board, if any
         self.is_destroyed = False
 
-    def update(self):
-        if self.is_destroyed:
-            return
-        _x, _y = self.x, self.y
+        game.board.place(x, y, self)
+        self.board_cell = (x, y)
+        game.missiles.add(self, x, y, direction)
 
-        if self.direction == game.LEFT:
-            self.x -= 1
-        elif self.direction == game.RIGHT:
-            self.x += 1
-        elif self.direction == game.UP:
-            self.y -= 1
-        elif self.direction == game.DOWN:
-            self.y += 1
+        self.particle_trail = None
+        if not game.headless:
+            self.particle_trail = game_effects.ParticleTrail(self, self.color)
+            game.effects.append(self.particle_trail)
 
-        # Check if Missile is out of bounds
-        if self.x < 0:
-            self.x = game.BOARD_WIDTH-1
-        if self.x >= game.BOARD_WIDTH:
-            self.x = 0
-        if self.y < 0:
-            self.y = game.BOARD_HEIGHT-1
-        if self.y >= game.BOARD_HEIGHT:
-            self.y = 0
+    @property
+    def x(self):
+        if self.slot is None:
+            return self._last_position[0]
+        return int(game.missiles.x[self.slot])
 
-        # Keep rect object up to date
-        self.rect = pygame.Rect(self.x*self.width, self.y*self.height, self.width, self.height)
+    @property
+    def y(self):
+        if self.slot is None:
+            return self._last_position[1]
+        return int(game.missiles.y[self.slot])
 
-        # Update game board
-        if game.board[_x][_y] == self:
-            game.board[_x][_y] = None
+    def remove_from_board(self):
+        if self.board_cell:
+            game.board.clear(*self.board_cell)
+            self.board_cell = None
+
+    def hit(self, x, y):
+        """ Moves the missile onto (x, y) and resolves whatever is there. """
+        self.remove_from_board()
         try:
-            game.board[self.x][self.y] = self
+            game.board.place(x, y, self)
+            self.board_cell = (x, y)
         except game.CollisionError, ce:
             if isinstance(ce.collidee, Missile):
                 ce.collidee.cleanup()
                 ce.collidee.remove_from_board()
             elif isinstance(ce.collidee, Wall):
                 ce.collidee.remove_from_board()
-                game.effects.append(game_effects.Explosion(ce.collidee.rect.centerx, ce.collidee.rect.centery, ce.collidee.color, max_speed=6, num_particles=5, particle_size=5, fade_speed=12))
+                game_effects.add_explosion(ce.collidee.rect.centerx, ce.collidee.rect.centery, ce.collidee.color, max_speed=6, num_particles=5, particle_size=5, fade_speed=12)
             elif isinstance(ce.collidee, SnakePart):
                 player = ce.collidee.player
                 if (player.x, player.y) == (ce.collidee.x, ce.collidee.y):
                     player.kill(self)
             elif isinstance(ce.collidee, Apple):
+                # Fly over apples without taking up the cell
                 return
             self.cleanup()
 
     def cleanup(self):
         self.is_destroyed = True
+        game_effects.add_explosion(self.rect.centerx, self.rect.centery, self.color, max_speed=15, num_particles=5, particle_size=4, fade_speed=10)
         game.missiles.remove(self)
-        game.effects.remove(self.particle_trail)
-        game.effects.append(game_effects.Explosion(self.rect.centerx, self.rect.centery, self.color, max_speed=15, num_particles=5, particle_size=4, fade_speed=10))
+        if self.particle_trail:
+            self.particle_trail.is_finished = True
+
+class Missiles(object):
+    """ All missiles in flight, stored as parallel arrays (x, y, direction,
+        owner) indexed by slot, with the Missile handles in _handles_.
+
+        Every tick all missiles advance at once. Missiles heading into an
+        empty cell nobody else is entering are moved on the board in one
+        batch; the rest resolve their collisions one by one. Removal swaps
+        the last missile into the freed slot, so it is O(1). """
+    DX = numpy.array([-1, 1, 0, 0], dtype=numpy.int32)  # Indexed by direction
+    DY = numpy.array([0, 0, -1, 1], dtype=numpy.int32)
+
+    def __init__(self, capacity=64):
+        self.x = numpy.zeros(capacity, dtype=numpy.int32)
+        self.y = numpy.zeros(capacity, dtype=numpy.int32)
+        self.direction = numpy.zeros(capacity, dtype=numpy.int8)
+        self.owner = numpy.zeros(capacity, dtype=numpy.int32)
+        self.handles = []
+        self._removed = None  # Removals are deferred while updating
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __iter__(self):
+        return iter(self.handles[:])
+
+    def add(self, missile, x, y, direction):
+        slot = len(self.handles)
+        if slot == len(self.x):
+            for name in ('x', 'y', 'direction', 'owner'):
+                array = getattr(self, name)
+                setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+        self.x[slot] = x
+        self.y[slot] = y
+        self.direction[slot] = direction
+        self.owner[slot] = missile.player.player_number
+        self.handles.append(missile)
+        missile.slot = slot
+
+    def remove(self, missile):
+        if missile.slot is None:
+            return
+        if self._removed is not None:
+            self._removed.append(missile)
+        else:
+            self._swap_remove(missile)
+
+    def _swap_remove(self, missile):
+        slot = missile.slot
+        missile._last_position = (int(self.x[slot]), int(self.y[slot]))
+        missile.slot = None
+
+        last = len(self.handles) - 1
+        if slot != last:
+            for array in (self.x, self.y, self.direction, self.owner):
+                array[slot] = array[last]
+            moved = self.handles[last]
+            self.handles[slot] = moved
+            moved.slot = slot
+        self.handles.pop()
+
+    def update(self):
+        count = len(self.handles)
+        if not count:
+            return
+
+        # Advance every missile, wrapping around the board edges
+        direction = self.direction[:count]
+        new_x = (self.x[:count] + self.DX[direction]) % game.BOARD_WIDTH
+        new_y = (self.y[:count] + self.DY[direction]) % game.BOARD_HEIGHT
+        self.x[:count] = new_x
+        self.y[:count] = new_y
+
+        # Missiles heading for an empty cell that no other missile is entering
+        # can all be moved at once.
+        new_cells = new_x * game.BOARD_HEIGHT + new_y
+        targets = game.board.cells.ravel()[new_cells]
+        first_entry = numpy.zeros(count, dtype=bool)
+        first_entry[numpy.unique(new_cells, return_index=True)[1]] = True
+        on_board = numpy.array([m.board_cell is not None for m in self.handles], dtype=bool)
+        unobstructed = (targets == board.EMPTY) & first_entry & on_board
+
+        handles = self.handles[:]
+        moving = numpy.flatnonzero(unobstructed)
+        if len(moving):
+            old_cells = numpy.array([handles[i].board_cell[0] * game.BOARD_HEIGHT + handles[i].board_cell[1] for i in moving])
+            game.board.move_many(old_cells, new_cells[moving])
+            for i, x, y in zip(moving.tolist(), new_x[moving].tolist(), new_y[moving].tolist()):
+                handles[i].board_cell = (x, y)
+
+        # Resolve the others in order, those running into something other than
+        # a missile first so missiles being destroyed this tick clear the way.
+        blocked = numpy.flatnonzero(~unobstructed)
+        if len(blocked):
+            blocked = blocked[numpy.argsort(targets[blocked] == board.MISSILE, kind='mergesort')]
+            self._removed = []
+            for i in blocked.tolist():
+                missile = handles[i]
+                if not missile.is_destroyed:
+                    missile.hit(int(new_x[i]), int(new_y[i]))
+            removed, self._removed = self._removed, None
+            for missile in removed:
+                self._swap_remove(missile)
+
+    def get_arrival_ticks(self, ticks):
+        """ Returns a flat array (indexed like board.Board's grids) with the
+            number of ticks until a missile first enters each cell, or -1 if
+            none does within _ticks_ ticks. Each missile is traced up to and
+            including the first cell holding something other than an apple. """
+        size = game.BOARD_WIDTH * game.BOARD_HEIGHT
+        count = len(self.handles)
+        if not count:
+            return numpy.repeat(numpy.int32(-1), size)
+
+        steps = numpy.arange(1, ticks + 1, dtype=numpy.int32)
+        direction = self.direction[:count]
+        xs = (self.x[:count, None] + self.DX[direction][:, None] * steps) % game.BOARD_WIDTH
+        ys = (self.y[:count, None] + self.DY[direction][:, None] * steps) % game.BOARD_HEIGHT
+        cells = xs * game.BOARD_HEIGHT + ys
+        hits = ~numpy.in1d(game.board.cells.ravel()[cells], (board.EMPTY, board.APPLE)).reshape(cells.shape)
+        reached = (numpy.cumsum(hits, axis=1) - hits) == 0
+
+        arrival = numpy.repeat(numpy.int32(ticks + 1), size)
+        numpy.minimum.at(arrival, cells[reached], numpy.tile(steps, (count, 1))[reached])
+        arrival[arrival > ticks] = -1
+        return arrival
+
+    def draw(self):
+        for missile in self.handles:
+            missile.draw()
 
 class Apple(GameObject):
+    cell_type = board.APPLE
+
     def __init__(self, x, y):
         super(Apple, self).__init__(x, y, pygame.Color(255, 0, 0))
         self.color_change = 4
@@ -127,10 +284,13 @@ class Apple(GameObject):
             self.color_change *= -1
 
     def draw(self):
-        radius = int(self.rect.width/2+1)  # Expand the diameter to the length of the diagonal
-        pygame.draw.circle(game.screen, self.color, self.rect.center, radius)
+        rect = game.viewport.cell_rect(self.x, self.y)
+        radius = int(rect.width/2+1)  # Expand the diameter to the length of the diagonal
+        pygame.draw.circle(game.screen, self.color, rect.center, radius)
 
 class Wall(GameObject):
+    cell_type = board.WALL
+
     def __init__(self, x, y):
         super(Wall, self).__init__(x, y, pygame.Color(139, 69, 0))
 
@@ -139,6 +299,8 @@ class Wall(GameObject):
         game.walls.remove(self)
 
 class IndestructableWall(GameObject):
+    cell_type = board.INDESTRUCTABLE_WALL
+
     def __init__(self, x, y):
         super(IndestructableWall, self).__init__(x, y, pygame.Color(99, 39, 20))
 
@@ -159,12 +321,12 @@ class Player(object):
         self.parts.append(SnakePart(self, self.x, self.y, color))
         self.grow = False
         self.is_dead = False
-        self.frames_until_update_position = 3
-        self.frame_count = 1
+        self.ticks_until_update_position = 3
+        self.tick_count = 1
         self._lock_set_direction = False
         self.is_invincible = False
         self.is_invisible = False
-        self.invincible_frame_count = 0
+        self.invincible_tick_count = 0
         self.deaths = []  # Array of things that collided with player
         self.kills = []  # Array of players you've killed
         self.AI_engine = None
@@ -173,11 +335,23 @@ class Player(object):
     def get_length(self):
         return len(self.parts)
 
+    def get_death_summary(self):
+        """ Counts deaths by cause. """
+        summary = {'collision': 0, 'missile': 0, 'wall': 0, 'suicide': 0}
+        for c in self.deaths:
+            if isinstance(c, (Missile, SnakePart)) and c.player is self:
+                summary['suicide'] += 1
+            elif isinstance(c, SnakePart):
+                summary['collision'] += 1
+            elif isinstance(c, Missile):
+                summary['missile'] += 1
+            elif isinstance(c, Wall):
+                summary['wall'] += 1
+        return summary
+
     def respawn(self):
         part = self.parts.pop()
         part.x, part.y = self.spawn_coordinates
-        part.rect = pygame.Rect(part.x*part.width, part.y*part.height,
-                part.width, part.height)
         self.x, self.y = self.spawn_coordinates
         self.direction = self.spawn_direction
         self.parts.clear()
@@ -187,16 +361,16 @@ class Player(object):
         self._lock_set_direction = False
 
     def update(self):
-        if self.frame_count < self.frames_until_update_position:
-            self.frame_count += 1
+        if self.tick_count < self.ticks_until_update_position:
+            self.tick_count += 1
         else:
             self.update_position()
-            self.frame_count = 1
+            self.tick_count = 1
 
         if self.is_invincible:
-            self.invincible_frame_count += 1
-            if self.invincible_frame_count == 4:
-                self.invincible_frame_count = 0
+            self.invincible_tick_count += 1
+            if self.invincible_tick_count == 4:
+                self.invincible_tick_count = 0
                 self.is_invisible = not self.is_invisible
 
     def update_position(self):
@@ -220,13 +394,11 @@ class Player(object):
             self.y = 0
 
         if self.is_invincible:
-            if isinstance(game.board[self.x][self.y], Apple):
+            if game.board.get_type(self.x, self.y) == board.APPLE:
                 self.is_invincible = False
             else:
                 head = self.parts[0]
                 head.x, head.y = self.x, self.y
-                head.rect = pygame.Rect(head.x*head.width, head.y*head.height,
-                        head.width, head.height)
                 self._lock_set_direction = False
                 return
 
@@ -277,7 +449,7 @@ class Player(object):
             part.remove_from_board()
 
         # Show explosion
-        game.effects.append(game_effects.Explosion(self.parts[-1].rect.left, self.parts[-1].rect.top, self.color, max_speed=22, num_particles=20, particle_size=5, fade_speed=6))
+        game_effects.add_explosion(self.parts[-1].rect.left, self.parts[-1].rect.top, self.color, max_speed=22, num_particles=20, particle_size=5, fade_speed=6)
 
         # Log it!
         log_text = self.name + " died!"
@@ -327,7 +499,6 @@ class Player(object):
             part = self.parts.popleft()  # Remove from the tail
             try:
                 missile = part.become_missile(self.x, self.y, self.direction)  # Move missile to the head
-                game.missiles.append(missile)
                 game.log_screen.add('%s fired a missile!' % self.name)
             except game.CollisionError, ce:
                 if isinstance(ce.collidee, Missile):
@@ -336,6 +507,9 @@ class Player(object):
                     self.parts.appendleft(part)
 
     def set_direction(self, direction):
+        if game.recorder:
+            game.recorder.record(self.player_number, direction)
+
         if self.is_dead or self._lock_set_direction:
             return
 
@@ -350,17 +524,19 @@ class Player(object):
 
 class LogScreen(object):
     def __init__(self):
-        pygame.font.init()
-        self.font = pygame.font.SysFont("verdana", 12)
         self.log = deque()
         self.log_size = 5
 
     def draw(self):
         for i, text in enumerate(self.log):
-            text = self.font.render(text, 1, (255, 255, 255))
+            text = fonts.render('log', text, (255, 255, 255))
             textpos = text.get_rect(top = 30 + i*20, right = game.WINDOW_WIDTH-30)
             game.screen.blit(text, textpos)
 
+    def get_rect(self):
+        """ Screen area the log is drawn in. """
+        return pygame.Rect(game.WINDOW_WIDTH/2, 25, game.WINDOW_WIDTH/2 - 25, self.log_size*20 + 10)
+
     def add(self, text):
         self.log.append(text)
         if len(self.log) > self.log_size:
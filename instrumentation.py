@@ -0,0 +1,154 @@
+""" Per-tick measurements of how the AIs spend their time.
+
+    Each AI owns an AIStats, which records one row per decision: the tick,
+    the wall time of execute(), the nodes its searches expanded, the length of
+    the path it is following, and how many searches it started and how many
+    of those ran out of time. Rows go into ring buffers, so recording costs a
+    few array stores and memory stays bounded however long the game runs.
+    The buffers are plain arrays that grow up to their capacity, unless the
+    numbers of an AI running in a process of its own are to be read by the
+    main process: then they are allocated in shared memory up front.
+
+    summary() reduces the buffers to percentiles per column, and
+    format_report() prints them, e.g. at the end of a simulated match.
+"""
+import ctypes
+import multiprocessing
+from array import array
+
+import numpy
+
+from timing import monotonic
+
+CAPACITY = 2048  # Rows kept per AI; older ones are overwritten
+PERCENTILES = (50, 95, 99)
+
+class RingBuffer(object):
+    """ The last _capacity_ values appended. With _shared_ they are kept in
+        shared memory, allocated in full, so a process forked afterwards can
+        append values the creating process reads; otherwise in an array that
+        grows as values are appended. """
+    def __init__(self, typecode, capacity=CAPACITY, shared=False):
+        self.capacity = capacity
+        self.dtype = numpy.dtype(typecode)
+        if shared:
+            self.data = multiprocessing.RawArray(typecode, capacity)
+            self.total = multiprocessing.RawValue('l', 0)  # Values ever appended
+        else:
+            self.data = array(typecode)
+            self.total = ctypes.c_long(0)
+
+    def __len__(self):
+        return min(self.total.value, self.capacity)
+
+    def append(self, value):
+        total = self.total.value
+        if len(self.data) < self.capacity:
+            self.data.append(value)  # Still growing; shared buffers never are
+        else:
+            self.data[total % self.capacity] = value
+        self.total.value = total + 1
+
+    def extend(self, values):
+        """ Appends the numpy array _values_ in one go. """
+        total = self.total.value
+        missing = min(total + len(values), self.capacity) - len(self.data)
+        if missing > 0:
+            self.data.extend(array(self.dtype.char, [0]) * missing)
+        data = numpy.frombuffer(self.data, dtype=self.dtype)
+        kept = values[-self.capacity:]
+        data[(total + len(values) - len(kept) + numpy.arange(len(kept))) % self.capacity] = kept
+        self.total.value = total + len(values)
+
+    def values(self):
+        """ The values kept, oldest first, as a numpy array. """
+        total = self.total.value
+        if not total:
+            return numpy.empty(0, dtype=self.dtype)
+        data = numpy.frombuffer(self.data, dtype=self.dtype)
+        if total <= self.capacity:
+            return data[:total].copy()
+        start = total % self.capacity
+        return numpy.concatenate((data[start:], data[:start]))
+
+class AIStats(object):
+    """ Decision measurements for one AI. Call begin() before and end() after
+        each execute(). """
+    COLUMNS = (
+        ('tick', 'l'),
+        ('execute_ms', 'd'),
+        ('expanded', 'l'),
+        ('path_length', 'l'),
+        ('replans', 'l'),
+        ('deadline_misses', 'l'),
+    )
+
+    def __init__(self, capacity=CAPACITY, shared=False):
+        self.columns = dict((name, RingBuffer(typecode, capacity, shared)) for name, typecode in self.COLUMNS)
+        self._start = None
+        self._expanded = 0
+        self._searches = 0
+        self._deadline_misses = 0
+
+    def __len__(self):
+        return len(self.columns['tick'])
+
+    def begin(self, grid):
+        """ Marks the start of a decision searched on _grid_ (a
+            pathfinding.Grid), whose counters are read again by end(). """
+        self._expanded = grid.expanded
+        self._searches = grid.searches
+        self._deadline_misses = grid.deadline_misses
+        self._start = monotonic()
+
+    def end(self, tick, grid, path_length):
+        elapsed = monotonic() - self._start
+        columns = self.columns
+        columns['tick'].append(tick)
+        columns['execute_ms'].append(elapsed * 1000)
+        columns['expanded'].append(grid.expanded - self._expanded)
+        columns['path_length'].append(path_length)
+        columns['replans'].append(grid.searches - self._searches)
+        columns['deadline_misses'].append(grid.deadline_misses - self._deadline_misses)
+
+    def summary(self, budget_ms=None):
+        """ Returns {column: {'p50', 'p95', 'p99', 'max', 'total'}} over the
+            rows kept, plus 'decisions', the 'slowest_tick' and, given a
+            _budget_ms_ per decision, how many decisions went 'over_budget'. """
+        summary = {'decisions': len(self)}
+        if not len(self):
+            return summary
+        for name, typecode in self.COLUMNS[1:]:
+            values = self.columns[name].values()
+            column = dict(('p%d' % p, value) for p, value in zip(PERCENTILES, numpy.percentile(values, PERCENTILES)))
+            column['max'] = values.max()
+            column['total'] = values.sum()
+            summary[name] = column
+        times = self.columns['execute_ms'].values()
+        summary['slowest_tick'] = int(self.columns['tick'].values()[times.argmax()])
+        if budget_ms is not None:
+            summary['over_budget'] = int((times > budget_ms).sum())
+        return summary
+
+def merge(stats_list):
+    """ Returns an AIStats holding the rows of all of _stats_list_, e.g. to
+        report on every AI of one kind in an arena at once. """
+    merged = AIStats(max(sum(len(stats) for stats in stats_list), 1))
+    for name, typecode in AIStats.COLUMNS:
+        for stats in stats_list:
+            merged.columns[name].extend(stats.columns[name].values())
+    return merged
+
+def format_report(name, stats, budget_ms=None):
+    """ Returns a few lines of text summarizing _stats_ for the AI _name_. """
+    summary = stats.summary(budget_ms)
+    if not summary['decisions']:
+        return "%s: no decisions recorded" % name
+    lines = ["%s: %d decisions, slowest at tick %d" % (name, summary['decisions'], summary['slowest_tick'])]
+    if budget_ms is not None:
+        lines[0] += ", %d over the %.1f ms budget" % (summary['over_budget'], budget_ms)
+    lines.append("    %-16s %9s %9s %9s %9s %10s" % ('', 'p50', 'p95', 'p99', 'max', 'total'))
+    for column, typecode in AIStats.COLUMNS[1:]:
+        values = summary[column]
+        lines.append("    %-16s %9.2f %9.2f %9.2f %9.2f %10.0f" % (column, values['p50'], values['p95'], values['p99'], values['max'], values['total']))
+    return '\n'.join(lines)
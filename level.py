@@ -20,20 +20,80 @@ directions = {
     'down': 3,
 }
 
+# Players past the numbered ones start on 'S' cells of the layout, then on
+# random empty cells with room around them and SPAWN_CLEARANCE empty cells
+# ahead, if one turns up within SPAWN_ATTEMPTS tries
+SPAWN_MARKER = 'S'
+SPAWN_CLEARANCE = 5
+SPAWN_ATTEMPTS = 100
+DIRECTION_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))  # In game.LEFT, RIGHT, UP, DOWN order
+
+def get_player_color(player_number):
+    """ The colour of player _player_number_ (counting from 1): the usual
+        four, then hues spread around the colour wheel, clear of the apples'
+        reds and yellows. """
+    if str(player_number) in player_colors:
+        return player_colors[str(player_number)]
+    color = pygame.Color(0, 0, 0)
+    color.hsva = (75 + (player_number * 137.508) % 270, 80, 100, 100)
+    return color
+
+def get_clear_direction(x, y):
+    """ Returns (direction, run): the direction with the longest run of
+        empty cells ahead of (x, y), up to SPAWN_CLEARANCE, and that run. """
+    best = (game.RIGHT, -1)
+    for direction, (dx, dy) in enumerate(DIRECTION_STEPS):
+        run = 0
+        while run < SPAWN_CLEARANCE and game.board.is_empty((x + dx*(run+1)) % game.BOARD_WIDTH, (y + dy*(run+1)) % game.BOARD_HEIGHT):
+            run += 1
+        if run > best[1]:
+            best = (direction, run)
+    return best
+
+def generate_spawn():
+    """ Picks an empty cell for a snake to start on. Returns (x, y,
+        direction), or None if the board is full. """
+    best = None
+    for i in range(SPAWN_ATTEMPTS):
+        cell = game.board.random_free_cell(game.rng)
+        if cell is None:
+            return None
+        x, y = cell
+        direction, run = get_clear_direction(x, y)
+        roomy = all(game.board.is_empty((x + dx) % game.BOARD_WIDTH, (y + dy) % game.BOARD_HEIGHT)
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+        if roomy and run == SPAWN_CLEARANCE:
+            return x, y, direction
+        if best is None or run > best[3]:
+            best = (x, y, direction, run)
+    return best[:3]
+
 class Level(object):
     def __init__(self, config_file):
         config = ConfigParser.SafeConfigParser()
         config.read(config_file)
 
+        self.config_file = config_file
         self.num_apples = config.getint('snake', 'num_apples')
         self.name = config.get('snake', 'name')
         self.kills_to_win = config.getint('snake', 'kills_to_win')
         self.layout = config.get('level', 'layout')
 
+        # The board is as large as the layout unless the level says otherwise;
+        # a smaller layout is laid out from the top-left corner
+        rows = self.layout.split('\n')[1:]
+        self.width = config.getint('level', 'width') if config.has_option('level', 'width') else max(len(row) for row in rows)
+        self.height = config.getint('level', 'height') if config.has_option('level', 'height') else len(rows)
+        if max(len(row) for row in rows) > self.width or len(rows) > self.height:
+            raise ValueError("%s: the layout doesn't fit a %dx%d board" % (config_file, self.width, self.height))
+
         self.player_directions = dict((key, directions.get(value)) for key, value in config.items('player_directions'))
 
     def parse_layout(self):
+        # Lay out walls and players first, then index the free cells in one go
+        game.board.suspend_free_cells()
         layout = self.layout.split('\n')[1:]
+        spawns = []
         for y, row in enumerate(layout):
             for x, column in enumerate(row):
                 if column == 'W':
@@ -43,6 +103,27 @@ class Level(object):
                 elif column in ('1', '2', '3', '4'):
                     if int(column) <= game.num_players:
                         game.players.append(game_objects.Player('Player %s' % column, int(column)-1, x, y, self.player_directions[column], player_colors[column]))
+                elif column == SPAWN_MARKER:
+                    spawns.append((x, y))
+        game.board.rebuild_free_cells()
+
+        # Any more players, as in an arena, take the spawn points in random
+        # order, then whatever room is left
+        game.rng.shuffle(spawns)
+        while len(game.players) < game.num_players:
+            if spawns:
+                x, y = spawns.pop()
+                direction = self.player_directions.get('s')
+                if direction is None:
+                    direction = get_clear_direction(x, y)[0]
+            else:
+                spawn = generate_spawn()
+                if spawn is None:
+                    break
+                x, y, direction = spawn
+            number = len(game.players) + 1
+            game.players.append(game_objects.Player('Player %d' % number, number-1, x, y, direction, get_player_color(number)))
+
         for i in range(self.num_apples):
             game.add_apple()
 
@@ -0,0 +1,336 @@
+""" Grid pathfinding shared by the AIs.
+
+    Cells are identified by flat indices (x*height + y, the same layout as
+    board.Board), so a search never allocates per-node objects: scores and
+    parents live in preallocated arrays, and a generation counter marks which
+    entries belong to the current search instead of clearing them between
+    searches. Neighbours are precomputed once per grid, including the
+    wrap-around at the board edges.
+
+    Benchmark the AIs' searches on the level files with:
+
+        python pathfinding.py --ticks 2000
+"""
+import argparse
+import os
+from array import array
+from heapq import heappush, heappop
+
+import numpy
+
+from timing import monotonic
+
+BLOCKED_CHARS = 'WISM'  # Cells of the shared board a snake can't move into
+MAX_GENERATION = 2**31 - 1
+DEADLINE_CHECK_INTERVAL = 32  # Expansions between clock reads
+
+_translations = {}
+
+def mask_from_chars(chars, wanted, invert=False):
+    """ Turns a flat string of board characters (e.g. the raw shared board)
+        into a bytearray that is 1 where the character is in _wanted_ (or,
+        with _invert_, where it isn't). """
+    table = _translations.get((wanted, invert))
+    if table is None:
+        table = _translations[wanted, invert] = ''.join('\1' if (chr(i) in wanted) != invert else '\0' for i in range(256))
+    return bytearray(str(chars).translate(table))
+
+def passable_from_chars(chars, blocked=BLOCKED_CHARS):
+    """ Returns a bytearray that is 1 where a snake can move. """
+    return mask_from_chars(chars, blocked, invert=True)
+
+def passable_from_cells(cells, blocked_types):
+    """ Same as passable_from_chars() for a numpy array of board cell types. """
+    return bytearray((~numpy.in1d(cells.ravel(), blocked_types)).astype(numpy.uint8).tostring())
+
+class Grid(object):
+    """ Search state for a width x height board.
+
+        After a search, _g_ holds the distance (or cost) of every reached cell
+        and _parent_ the cell it was reached from; both are only meaningful
+        where is_reached() is true. _expanded_ counts the cells expanded over
+        all searches and _last_expanded_ those of the latest one; _searches_
+        counts the searches, _deadline_misses_ those that timed out and
+        _search_time_ the seconds spent in them. """
+    def __init__(self, width, height, wrap=True):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.wrap = wrap
+
+        # Four neighbours per cell, in game.LEFT, RIGHT, UP, DOWN order; -1
+        # marks an edge when the grid doesn't wrap. Built with numpy, as
+        # large boards have millions of them.
+        x, y = numpy.divmod(numpy.arange(self.size), height)
+        columns = []
+        for nx, ny in ((x-1, y), (x+1, y), (x, y-1), (x, y+1)):
+            if wrap:
+                columns.append((nx % width)*height + ny % height)
+            else:
+                inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+                columns.append(numpy.where(inside, nx*height + ny, -1))
+        self.neighbors = array('i', numpy.column_stack(columns).astype(numpy.intc).tostring())
+
+        self.g = array('i', [0]) * self.size
+        self.parent = array('i', [-1]) * self.size
+        self.seen = array('i', [0]) * self.size  # Generation that reached the cell
+        self.closed = array('i', [0]) * self.size  # Generation that expanded the cell
+        self.generation = 0
+        self.expanded = 0
+        self.last_expanded = 0
+        self.searches = 0
+        self.deadline_misses = 0
+        self.search_time = 0.0
+        self.timed_out = False
+
+    def index(self, x, y):
+        return x*self.height + y
+
+    def coordinates(self, index):
+        return divmod(index, self.height)
+
+    def distance(self, index1, index2):
+        """ Least number of steps between two cells, ignoring obstacles. """
+        x1, y1 = divmod(index1, self.height)
+        x2, y2 = divmod(index2, self.height)
+        dx = abs(x1 - x2)
+        dy = abs(y1 - y2)
+        if self.wrap:
+            dx = min(dx, self.width - dx)
+            dy = min(dy, self.height - dy)
+        return dx + dy
+
+    def is_reached(self, index):
+        return self.seen[index] == self.generation
+
+    def retrace(self, index):
+        """ Returns the cells from the search's start up to _index_. """
+        path = []
+        parent = self.parent
+        while index != -1:
+            path.append(index)
+            index = parent[index]
+        path.reverse()
+        return path
+
+    def _begin(self, excluded):
+        self.generation += 1
+        if self.generation == MAX_GENERATION:
+            self.seen = array('i', [0]) * self.size
+            self.closed = array('i', [0]) * self.size
+            self.generation = 1
+        for index in excluded:
+            self.closed[index] = self.generation
+        return self.generation
+
+    def bfs(self, sources, passable, goals=None, excluded=()):
+        """ Breadth-first search from every cell in _sources_ at once.
+
+            With _goals_ (a sequence that is true for goal cells) the search
+            stops at the nearest goal and returns it, or None if none can be
+            reached. Without, it floods everything reachable, leaving the
+            distance to the nearest source in _g_. Sources are expanded even
+            when they aren't passable, e.g. a snake's own head; _excluded_
+            cells are never entered. """
+        started = monotonic()
+        generation = self._begin(excluded)
+        g, parent, seen, closed, neighbors = self.g, self.parent, self.seen, self.closed, self.neighbors
+
+        frontier = []
+        for source in sources:
+            if seen[source] != generation:
+                seen[source] = generation
+                g[source] = 0
+                parent[source] = -1
+                frontier.append(source)
+
+        expanded = 0
+        found = None
+        distance = 0
+        while frontier and found is None:
+            distance += 1
+            next_frontier = []
+            for current in frontier:
+                expanded += 1
+                if goals is not None and goals[current]:
+                    found = current
+                    break
+                base = current * 4
+                for neighbor in neighbors[base:base+4]:
+                    if neighbor < 0 or seen[neighbor] == generation or closed[neighbor] == generation or not passable[neighbor]:
+                        continue
+                    seen[neighbor] = generation
+                    g[neighbor] = distance
+                    parent[neighbor] = current
+                    next_frontier.append(neighbor)
+            frontier = next_frontier
+
+        self.last_expanded = expanded
+        self.expanded += expanded
+        self.searches += 1
+        self.search_time += monotonic() - started
+        return found
+
+    def find_path(self, start, goal, passable, goals=None, excluded=(), heuristic_scale=1, weights=None, deadline=None):
+        """ A* from _start_ to _goal_ over unit step costs, returning the list
+            of cells from _start_ to the goal, or None if it can't be reached.
+
+            The heuristic is the wrapped Manhattan distance times
+            _heuristic_scale_, plus weights[cell] times _heuristic_scale_ if
+            _weights_ is given (which makes the search prefer open space over
+            shortest paths). Open-set entries are never removed: improving a
+            cell pushes a new entry and stale ones are skipped when popped.
+
+            With _goals_, the search also ends as soon as it discovers any
+            other goal cell and returns the path to that one instead.
+
+            With a _deadline_ (a timing.monotonic() time) the search is
+            anytime: if it runs out of time it sets _timed_out_ and returns
+            the path to the expanded cell with the best heuristic so far. """
+        started = monotonic()
+        self.timed_out = False
+        generation = self._begin(excluded)
+        g, parent, seen, closed, neighbors = self.g, self.parent, self.seen, self.closed, self.neighbors
+        width, height, wrap = self.width, self.height, self.wrap
+        goal_x, goal_y = divmod(goal, height)
+
+        def heuristic(index):
+            x, y = divmod(index, height)
+            dx = x - goal_x if x > goal_x else goal_x - x
+            dy = y - goal_y if y > goal_y else goal_y - y
+            if wrap:
+                if dx > width - dx:
+                    dx = width - dx
+                if dy > height - dy:
+                    dy = height - dy
+            if weights is not None:
+                return (dx + dy + weights[index]) * heuristic_scale
+            return (dx + dy) * heuristic_scale
+
+        seen[start] = generation
+        g[start] = 0
+        parent[start] = -1
+        h = heuristic(start)
+        open_heap = [(h, h, start)]
+        best, best_h = start, h
+
+        expanded = 0
+        found = None
+        while open_heap:
+            f, h, current = heappop(open_heap)
+            if closed[current] == generation or f - h != g[current]:
+                continue  # Stale entry
+            if current == goal:
+                found = current
+                break
+            closed[current] = generation
+            expanded += 1
+            if h < best_h:
+                best, best_h = current, h
+            if deadline is not None and not expanded % DEADLINE_CHECK_INTERVAL and monotonic() >= deadline:
+                self.timed_out = True
+                found = best
+                break
+
+            cost = g[current] + 1
+            base = current * 4
+            for neighbor in neighbors[base:base+4]:
+                if neighbor < 0 or closed[neighbor] == generation or not passable[neighbor]:
+                    continue
+                if seen[neighbor] == generation and cost >= g[neighbor]:
+                    continue
+                seen[neighbor] = generation
+                g[neighbor] = cost
+                parent[neighbor] = current
+                if goals is not None and neighbor != goal and goals[neighbor]:
+                    found = neighbor
+                    open_heap = None
+                    break
+                h = heuristic(neighbor)
+                heappush(open_heap, (cost + h, h, neighbor))
+
+        self.last_expanded = expanded
+        self.expanded += expanded
+        self.searches += 1
+        self.search_time += monotonic() - started
+        if self.timed_out:
+            self.deadline_misses += 1
+        if found is None:
+            return None
+        return self.retrace(found)
+
+    def find_nearest(self, start, goals, passable, excluded=()):
+        """ Path from _start_ to the nearest goal cell by actual distance, or
+            None if no goal can be reached. """
+        found = self.bfs((start,), passable, goals, excluded)
+        if found is None:
+            return None
+        return self.retrace(found)
+
+    def descend(self, field, index):
+        """ The neighbour of _index_ with the lowest non-negative value in
+            _field_ (a flat distance field such as game.apple_distances), or
+            None if no neighbour has one. """
+        best, best_value = None, None
+        base = index * 4
+        for neighbor in self.neighbors[base:base+4]:
+            if neighbor < 0:
+                continue
+            value = field[neighbor]
+            if value >= 0 and (best is None or value < best_value):
+                best, best_value = neighbor, value
+        return best
+
+    def descend_path(self, field, index):
+        """ Follows _field_ downhill from _index_ to a cell where it is 0,
+            returning the cells after _index_ (so its length is the distance),
+            or None if no such cell can be reached. _index_ itself may be
+            blocked, e.g. a snake's own head. """
+        path = []
+        value = field[index]
+        while value != 0:
+            index = self.descend(field, index)
+            if index is None or 0 < value <= field[index]:
+                return None  # Dead end, or the field changed under us
+            value = field[index]
+            path.append(index)
+        return path
+
+def benchmark(level_file, ticks, seed=0):
+    """ Plays a headless match of the AI Demo line-up on _level_file_ and
+        totals the searches each kind of AI ran on its own grid. Returns
+        {AI class name: (searches, expanded nodes per second, ms per search)}. """
+    import level
+    import simulation
+    sim = simulation.Simulation(level.Level(level_file), seed=seed)
+    sim.run(ticks)
+    totals = {}
+    for ai in sim.ai_processes:
+        counts = totals.setdefault(type(ai).__name__, [0, 0, 0.0])
+        if ai.grid is not None:
+            counts[0] += ai.grid.searches
+            counts[1] += ai.grid.expanded
+            counts[2] += ai.grid.search_time
+    sim.stop()
+
+    results = {}
+    for name, (searches, expanded, elapsed) in totals.items():
+        elapsed = max(elapsed, 1e-9)
+        results[name] = (searches, expanded / elapsed, elapsed * 1000 / max(searches, 1))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AIs' pathfinding on the level files.")
+    parser.add_argument('levels', nargs='*', help="Level files (default: all of levels/)")
+    parser.add_argument('--ticks', type=int, default=2000, help="Maximum number of ticks to play per level")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the matches")
+    args = parser.parse_args()
+
+    level_files = args.levels or sorted(os.path.join('levels', f) for f in os.listdir('levels'))
+    print "%-26s %-10s %9s %14s %10s" % ('Level', 'AI', 'Searches', 'Expanded/s', 'ms/search')
+    for level_file in level_files:
+        for name, (searches, rate, latency) in sorted(benchmark(level_file, args.ticks, args.seed).items()):
+            print "%-26s %-10s %9d %14.0f %10.3f" % (level_file, name, searches, rate, latency)
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,224 @@
 from multiprocessing import Process, Event
-from ctypes import Structure, c_int
 
 from pygame.locals import *
 
 import game
-import game_objects
-
-class GameObject(Structure):
-    _fields_ = [('x', c_int), ('y', c_int)]
-
-    def __repr__(self):
-        return '(%d, %d)' % (self.x, self.y,)
-
-class MovableGameObject(Structure):
-    _anonymous_ = ('game_object',)
-    _fields_ = [('game_object', GameObject), ('direction', c_int),
-            ('length', c_int),]
-
-    def __repr__(self):
-        return '(%d, %d) %d' % (self.x, self.y, self.direction,)
-
-class Serializer(object):
-    def serialize_board(self, board, _board):
-        for x, row in enumerate(board):
-            for y, obj in enumerate(row):
-                _board[x][y] = self.translate_board_obj(obj)
-        return _board
-
-    def translate_board_obj(self, obj):
-        if isinstance(obj, game_objects.Wall):
-            return 'W'
-        elif isinstance(obj, game_objects.IndestructableWall):
-            return 'I'
-        elif isinstance(obj, game_objects.Apple):
-            return 'A'
-        elif isinstance(obj, game_objects.SnakePart):
-            return 'S'
-        elif isinstance(obj, game_objects.Missile):
-            return 'M'
-        return ' '
+import instrumentation
+import pathfinding
+from snapshot import GameObject, MovableGameObject, SnapshotReader
 
 class AIProcess(Process):
-    """ Wrapper class for a python process. """
-    def __init__(self, player_index, board, players, apples, *args, **kwargs):
+    """ Wrapper class for a python process. When started, it sleeps until the
+        game publishes a new state and then thinks about it once.
+
+        An AI created with an AIBatch's _reader_ shares the batch's copy of
+        the state and is stepped by the batch instead. _think_time_ caps the
+        seconds an AI that searches against a deadline (such as JameelAI)
+        spends on a move; None leaves it to the AI's own default. """
+    WAIT_TIMEOUT = 1.0  # Seconds between checks for shutdown() while idle
+    def __init__(self, player_index, snapshot, *args, **kwargs):
+        reader = kwargs.pop('reader', None)
+        self.think_time = kwargs.pop('think_time', None)
         super(AIProcess, self).__init__(*args, **kwargs)
         self.player_index = player_index
         self.input_queue = kwargs['args'][0]
-        self.board = board
-        self.apples = list(apples)
-        self._players = players
+        self.reader = reader or SnapshotReader(snapshot)
+        self.grid = None
+        self.stats = instrumentation.AIStats()
         self.stop = Event()
+        self.commands = []  # (player index, direction) pairs not sent yet
+        self.reader.read()
+        self.load_state()
 
     @property
     def player(self):
         return self._players[self.player_index]
 
+    def start(self):
+        if game.ai_stats:
+            # Reported by the main process at the end of the game
+            self.stats = instrumentation.AIStats(shared=True)
+        super(AIProcess, self).start()
+
     def run(self):
         while not self.stop.is_set():
-            self.execute()
+            if self.reader.wait(self.WAIT_TIMEOUT):
+                self.step()
+
+    def step(self):
+        """ Thinks once about the latest published game state, if there is a
+            new one. """
+        if self.update_state():
+            self.think()
+            self.send_commands()
+
+    def think(self):
+        """ Runs execute() on the state loaded last and records how it went. """
+        grid = self.get_grid()
+        self.stats.begin(grid)
+        self.execute()
+        self.stats.end(self.tick, grid, self.get_path_length())
+
+    def send_commands(self):
+        """ Sends the commands given since the last call to the game, as one
+            message. """
+        if self.commands:
+            self.input_queue.put_nowait(self.commands)
+            self.commands = []
+
+    def update_state(self):
+        """ Copies the game's latest snapshot, if it has published a new one
+            since the last call, and loads it. Returns whether it did. """
+        if not self.reader.read():
+            return False
+        self.load_state()
+        return True
+
+    def load_state(self):
+        """ Points the attributes AIs read at the snapshot the reader copied
+            last: _board_ ([x][y] characters), _players_, _apples_,
+            _missiles_ and the flat per-tick maps (see
+            game.sync_shared_state). """
+        reader = self.reader
+        frame = reader.frame
+        self.tick = frame.tick
+        self.board = frame.board
+        self._players = reader.players
+        self.apples = reader.apples
+        self.missiles = reader.missiles
+        self.apple_distances = frame.apple_distances
+        self.missile_ticks = frame.missile_ticks
+        self.head_reach = frame.head_reach
+        self.head_owner = frame.head_owner
+        self.rival_reach = frame.rival_reach
+
+    def get_grid(self):
+        if self.grid is None:
+            self.grid = pathfinding.Grid(game.BOARD_WIDTH, game.BOARD_HEIGHT)
+        return self.grid
+
+    def get_path_length(self):
+        """ Override to report how many moves are left on the planned path. """
+        return 0
+
+    def get_nearest_apple(self, x, y):
+        """ Returns (distance, apple) for the apple nearest to (x, y) going
+            around obstacles, or None if no apple can be reached. """
+        grid = self.get_grid()
+        path = grid.descend_path(self.apple_distances, grid.index(x, y))
+        if path is None:
+            return None
+        apple_x, apple_y = grid.coordinates(path[-1]) if path else (x, y)
+        for apple in self.apples:
+            if (apple.x, apple.y) == (apple_x, apple_y):
+                return len(path), apple
+        return None
+
+    def get_missile_arrival(self, x, y):
+        """ Ticks until a missile enters (x, y), or -1 if none will within
+            game.DANGER_TICKS. """
+        return self.missile_ticks[x*game.BOARD_HEIGHT + y]
+
+    def get_enemy_reach(self, x, y):
+        """ Fewest moves another snake's head needs to reach (x, y), or -1 if
+            none can within game.DANGER_MOVES. """
+        index = x*game.BOARD_HEIGHT + y
+        if self.head_owner[index] != self.player_index:
+            return self.head_reach[index]
+        return self.rival_reach[index]
 
     def shutdown(self):
         self.stop.set()
+        self.reader.snapshot.wake()
 
-    def _press(self, key):
-        self.input_queue.put_nowait(key)
+    def steer(self, direction):
+        """ Turns the snake to _direction_ (game.LEFT, RIGHT, UP or DOWN), or
+            fires if it's already heading that way. Commands go to the game
+            once execute() returns, and are applied before the next update. """
+        self.commands.append((self.player_index, direction))
 
     def press_left(self):
-        self._press(game.player_controls[self.player_index][game.LEFT])
+        self.steer(game.LEFT)
 
     def press_right(self):
-        self._press(game.player_controls[self.player_index][game.RIGHT])
+        self.steer(game.RIGHT)
 
     def press_up(self):
-        self._press(game.player_controls[self.player_index][game.UP])
+        self.steer(game.UP)
 
     def press_down(self):
-        self._press(game.player_controls[self.player_index][game.DOWN])
+        self.steer(game.DOWN)
 
     def execute(self):
-        """ Override this method to control your snake. Use a press_* function
-            to submit a key press on behalf of the player. """
+        """ Override this method to control your snake. Use steer() or a
+            press_* function to give a command on behalf of the player. """
         pass
+
+class AIBatch(Process):
+    """ A group of AIProcesses stepped together, in the calling process or,
+        when started, in a process of their own. The latest state is copied
+        once for the whole group and their commands are sent as one message,
+        so a game can run far more AIs than it could run processes. """
+    WAIT_TIMEOUT = AIProcess.WAIT_TIMEOUT
+
+    def __init__(self, snapshot, input_queue):
+        super(AIBatch, self).__init__()
+        self.input_queue = input_queue
+        self.reader = SnapshotReader(snapshot)
+        self.ais = []
+        self.stop = Event()
+
+    def start(self):
+        if game.ai_stats:
+            for ai in self.ais:
+                ai.stats = instrumentation.AIStats(shared=True)
+        super(AIBatch, self).start()
+
+    def run(self):
+        while not self.stop.is_set():
+            if self.reader.wait(self.WAIT_TIMEOUT):
+                self.step()
+
+    def step(self):
+        """ Has every AI think once about the latest published game state,
+            if there is a new one. """
+        if not self.reader.read():
+            return
+        commands = []
+        for ai in self.ais:
+            ai.load_state()
+            ai.think()
+            commands.extend(ai.commands)
+            ai.commands = []
+        if commands:
+            self.input_queue.put_nowait(commands)
+
+    def shutdown(self):
+        self.stop.set()
+        self.reader.snapshot.wake()
+
+def create_ais(ai_classes, snapshot, input_queue, batch_size=None, think_time=None):
+    """ Creates an AI for each player from _ai_classes_, in player order.
+        Returns (ais, steppers): the AIs, and what to step() (or start()) in
+        their place. Given a _batch_size_, AIProcesses are grouped into
+        AIBatches of up to that many; other AIs, which read the game
+        directly, are always stepped on their own. A _think_time_ is passed
+        on to every AIProcess. """
+    ais = []
+    steppers = []
+    batch = None
+    for i, _class in enumerate(ai_classes):
+        kwargs = dict(player_index=i, snapshot=snapshot, player=game.players[i], args=(input_queue,))
+        if think_time is not None and issubclass(_class, AIProcess):
+            kwargs['think_time'] = think_time
+        if batch_size and issubclass(_class, AIProcess):
+            if batch is None or len(batch.ais) == batch_size:
+                batch = AIBatch(snapshot, input_queue)
+                steppers.append(batch)
+            ai = _class(reader=batch.reader, **kwargs)
+            batch.ais.append(ai)
+        else:
+            ai = _class(**kwargs)
+            steppers.append(ai)
+        ais.append(ai)
+    return ais, steppers
@@ -0,0 +1,114 @@
+""" Per-phase timings of the interactive game's frames.
+
+    The main loop calls mark() after each part of a frame (waiting for the
+    frame limiter, input, AIs, effects, the game update, ...), which charges
+    the time since the previous mark to that phase; end_frame() closes the
+    frame. Frames are kept in rolling windows for the on-screen HUD, which
+    shows the mean of each phase over the last WINDOW frames, and in ring
+    buffers for the summary printed when a match ends.
+
+    Turn it on with frame_profiler in snake.ini.
+"""
+from collections import deque
+
+import numpy
+import pygame
+
+import fonts
+import game
+from instrumentation import RingBuffer, PERCENTILES
+from timing import monotonic
+
+PHASES = ('wait', 'input', 'ai', 'effects', 'update', 'sync', 'draw', 'scoreboard', 'win', 'profiler', 'flip')
+COUNTERS = ('effects', 'missiles')  # Values shown on the HUD besides the phases
+WINDOW = 30  # Frames averaged by the HUD
+HUD_INTERVAL = 10  # Frames between HUD text updates
+HUD_LINE_HEIGHT = 14
+HUD_WIDTH = 170
+HUD_POSITION = (10, 10)
+
+def get_hud_rect():
+    """ Screen area the HUD is drawn in. """
+    lines = 1 + len(PHASES) + len(COUNTERS)
+    return pygame.Rect(HUD_POSITION, (HUD_WIDTH, lines*HUD_LINE_HEIGHT + 8))
+
+class FrameProfiler(object):
+    """ Frame timings of one match. """
+    def __init__(self, window=WINDOW):
+        self.windows = dict((phase, deque(maxlen=window)) for phase in PHASES)
+        self.totals = deque(maxlen=window)
+        self.phase_times = dict((phase, RingBuffer('d')) for phase in PHASES)
+        self.frame_times = RingBuffer('d')
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lines = []
+        self.surface = None  # The HUD as last drawn, until the lines change
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._frame_start = self._last_mark = monotonic()
+        self._frames = 0
+
+    def mark(self, phase):
+        """ Charges the time since the previous mark to _phase_. """
+        now = monotonic()
+        self._current[phase] += now - self._last_mark
+        self._last_mark = now
+
+    def count(self, name, value):
+        """ Shows _value_ as the counter _name_ (one of COUNTERS) on the HUD. """
+        self.counters[name] = value
+
+    def end_frame(self):
+        now = monotonic()
+        current = self._current
+        for phase in PHASES:
+            elapsed_ms = current[phase] * 1000
+            self.windows[phase].append(elapsed_ms)
+            self.phase_times[phase].append(elapsed_ms)
+            current[phase] = 0.0
+        frame_ms = (now - self._frame_start) * 1000
+        self.totals.append(frame_ms)
+        self.frame_times.append(frame_ms)
+        self._frame_start = self._last_mark = now
+        self._frames += 1
+        if self._frames % HUD_INTERVAL == 1:
+            self.lines = self.get_hud_lines()
+            self.surface = None
+
+    def get_hud_lines(self):
+        """ The HUD's text: the mean ms per phase over the window, the frame
+            rate, and the counters. """
+        frame_ms = sum(self.totals) / max(len(self.totals), 1)
+        lines = ["frame %6.2f ms %5.1f fps" % (frame_ms, 1000.0 / max(frame_ms, 1e-3))]
+        for phase in PHASES:
+            window = self.windows[phase]
+            lines.append("%-10s %6.2f ms" % (phase, sum(window) / max(len(window), 1)))
+        for name in COUNTERS:
+            lines.append("%-10s %6d" % (name, self.counters[name]))
+        return lines
+
+    def draw(self):
+        rect = get_hud_rect()
+        if self.surface is None:
+            self.surface = pygame.Surface(rect.size).convert()
+            self.surface.fill(pygame.Color(0, 0, 0))
+            for i, line in enumerate(self.lines):
+                self.surface.blit(fonts.render('profiler', line, (200, 200, 200)), (4, 4 + i*HUD_LINE_HEIGHT))
+        game.screen.blit(self.surface, rect)
+
+    def format_summary(self, budget_ms=None):
+        """ Returns a few lines of text with percentiles of each phase and
+            the whole frame over the match, and, given the _budget_ms_ per
+            frame, how many frames went over it. """
+        frames = self.frame_times.values()
+        if not len(frames):
+            return "Frame profile: no frames recorded"
+        lines = ["Frame profile: %d frames" % len(frames)]
+        if budget_ms is not None:
+            # The frame limiter's wait is the slack in the budget, not part of it
+            busy = frames - self.phase_times['wait'].values()
+            lines[0] += ", %d over the %.1f ms budget" % ((busy > budget_ms).sum(), budget_ms)
+        lines.append("    %-12s %9s %9s %9s %9s %9s" % (('', 'mean') + tuple('p%d' % p for p in PERCENTILES) + ('max',)))
+        rows = [(phase, self.phase_times[phase].values()) for phase in PHASES] + [('frame', frames)]
+        for name, values in rows:
+            p50, p95, p99 = numpy.percentile(values, PERCENTILES)
+            lines.append("    %-12s %9.2f %9.2f %9.2f %9.2f %9.2f" % (name, values.mean(), p50, p95, p99, values.max()))
+        return '\n'.join(lines)
@@ -0,0 +1,188 @@
+import numpy
+import pygame
+
+import board
+import game
+
+CELL_PADDING = 2  # Apples are drawn a pixel wider than their cell
+WALL_TYPES = (board.WALL, board.INDESTRUCTABLE_WALL)
+
+class DirtyRenderer(object):
+    """ Draws the game by repainting only the parts of the screen that changed
+        since the last frame, and updating just those with
+        pygame.display.update(rects).
+
+        Walls are drawn once onto a cached background layer. Changed board
+        cells are found by comparing the entity ids of the cells in view with
+        the previous frame's. Apples (which pulse), missiles, invincible
+        snakes (which aren't on the board), effects and the HUD are repainted
+        every frame in both their old and new position. When the viewport
+        scrolls, the whole screen is redrawn.
+
+        Cells are addressed in view coordinates (vx*view height + vy) here,
+        so a frame's cost depends on the size of the view, not the board. """
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = None
+        self.board = None
+        self.view = None  # Viewport position and size the snapshot was taken at
+        self.last_ids = None
+        self.last_cells = None
+        self.last_extra_cells = set()
+        self.last_effect_rects = []
+        self.hud_rects = []
+        self.rects = []
+        self.full_redraw = True
+
+    def invalidate(self):
+        """ Redraw the whole screen on the next frame. """
+        self.full_redraw = True
+
+    def add_hud_rect(self, rect):
+        """ Marks a screen region the caller redraws every frame, e.g. the
+            scoreboard. """
+        self.hud_rects.append(pygame.Rect(rect))
+
+    def cell_rect(self, view_x, view_y):
+        return pygame.Rect(view_x*game.CELL_WIDTH, view_y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT)
+
+    def cells_in_rect(self, rect):
+        """ Slices of the [x, y] view grid overlapping _rect_. """
+        left = max(rect.left // game.CELL_WIDTH, 0)
+        right = min((rect.right - 1) // game.CELL_WIDTH, game.viewport.width - 1)
+        top = max(rect.top // game.CELL_HEIGHT, 0)
+        bottom = min((rect.bottom - 1) // game.CELL_HEIGHT, game.viewport.height - 1)
+        return slice(left, max(right + 1, left)), slice(top, max(bottom + 1, top))
+
+    def build_background(self):
+        self.background = pygame.Surface(self.screen.get_size()).convert()
+        self.background.fill(pygame.Color(0, 0, 0))
+        screen, game.screen = game.screen, self.background
+        visible = game.viewport.indices.ravel()
+        objects = game.board.objects
+        for entity_id in game.board.ids.ravel()[visible[numpy.in1d(game.board.cells.ravel()[visible], WALL_TYPES)]].tolist():
+            objects[entity_id].draw()
+        game.screen = screen
+
+    def get_view(self):
+        viewport = game.viewport
+        return (viewport.x, viewport.y, viewport.width, viewport.height)
+
+    def snapshot_board(self):
+        self.board = game.board
+        self.view = self.get_view()
+        visible = game.viewport.indices.ravel()
+        self.last_ids = game.board.ids.ravel()[visible]
+        self.last_cells = game.board.cells.ravel()[visible]
+
+    def get_extra_cells(self, off_board_parts):
+        """ Cells in view that need repainting every frame regardless of the
+            board. """
+        cells = set()
+        viewport = game.viewport
+        height = viewport.height
+        for thing in game.apples + list(game.missiles) + off_board_parts:
+            view = viewport.to_view(thing.x, thing.y)
+            if view is not None:
+                cells.add(view[0]*height + view[1])
+        return cells
+
+    def draw_everything(self):
+        self.build_background()
+        self.snapshot_board()
+        self.screen.blit(self.background, (0, 0))
+        game.draw()
+        for effect in game.effects:
+            effect.draw()
+        self.last_extra_cells = self.get_extra_cells(game.get_off_board_parts())
+        self.last_effect_rects = [r for r in (e.get_bounding_rect() for e in game.effects) if r]
+        self.rects = None
+        self.full_redraw = False
+
+    def draw(self):
+        if self.full_redraw or game.board is not self.board or self.get_view() != self.view:
+            self.draw_everything()
+            return
+
+        visible = game.viewport.indices.ravel()
+        cells = game.board.cells.ravel()[visible]
+        ids = game.board.ids.ravel()[visible]
+        last_cells = self.last_cells
+        changed = numpy.flatnonzero(ids != self.last_ids)
+        width, height = game.viewport.width, game.viewport.height
+
+        # Walls only ever disappear once the level is loaded
+        destroyed = changed[numpy.in1d(last_cells[changed], WALL_TYPES) & ~numpy.in1d(cells[changed], WALL_TYPES)]
+        for index in destroyed.tolist():
+            self.background.fill(pygame.Color(0, 0, 0), self.cell_rect(*divmod(index, height)))
+        self.last_ids = ids
+        self.last_cells = cells
+
+        off_board_parts = game.get_off_board_parts()
+        extra_cells = self.get_extra_cells(off_board_parts)
+        dirty_cells = set(changed.tolist()) | extra_cells | self.last_extra_cells
+        self.last_extra_cells = extra_cells
+
+        effect_rects = [r for r in (e.get_bounding_rect() for e in game.effects) if r]
+        area_rects = effect_rects + self.last_effect_rects + self.hud_rects
+        self.last_effect_rects = effect_rects
+
+        # Repaint the background under everything that changed
+        rects = []
+        for index in dirty_cells:
+            rects.append(self.cell_rect(*divmod(index, height)).inflate(CELL_PADDING*2, CELL_PADDING*2))
+        rects.extend(area_rects)
+        for rect in rects:
+            self.screen.blit(self.background, rect, rect)
+
+        # Redraw whatever sits in, or spills into, the repainted areas
+        redraw = numpy.zeros((width, height), dtype=bool)
+        if dirty_cells:
+            xs, ys = numpy.divmod(numpy.fromiter(dirty_cells, dtype=numpy.intp, count=len(dirty_cells)), height)
+            for i in (-1, 0, 1):
+                for j in (-1, 0, 1):
+                    redraw[numpy.clip(xs + i, 0, width - 1), numpy.clip(ys + j, 0, height - 1)] = True
+        for rect in area_rects:
+            redraw[self.cells_in_rect(rect)] = True
+        redraw = redraw.ravel()
+        is_wall = (cells == board.WALL) | (cells == board.INDESTRUCTABLE_WALL)
+
+        # Same order as game.draw(): apples first, then the walls they spill
+        # into are restored from the background, then everything else
+        apples = []
+        for apple in game.apples:
+            view = game.viewport.to_view(apple.x, apple.y)
+            if view is not None and redraw[view[0]*height + view[1]]:
+                apple.draw()
+                apples.append(view)
+        if apples:
+            xs, ys = numpy.array(apples).T
+            for i in (-1, 0, 1):
+                for j in (-1, 0, 1):
+                    neighbours = numpy.clip(xs + i, 0, width - 1) * height + numpy.clip(ys + j, 0, height - 1)
+                    for index in neighbours[is_wall[neighbours]].tolist():
+                        rect = self.cell_rect(*divmod(index, height))
+                        self.screen.blit(self.background, rect, rect)
+        others = numpy.flatnonzero(redraw & (cells != board.EMPTY) & (cells != board.APPLE) & ~is_wall)
+        objects = game.board.objects
+        for index in ids[others].tolist():
+            objects[index].draw()
+
+        # Draw what isn't on the board
+        for missile in game.missiles:
+            if missile.board_cell is None and game.viewport.is_visible(missile.x, missile.y):
+                missile.draw()
+        for part in off_board_parts:
+            if game.viewport.is_visible(part.x, part.y):
+                part.draw()
+        game.log_screen.draw()
+        for effect in game.effects:
+            effect.draw()
+
+        self.rects = rects
+
+    def update_display(self):
+        if self.rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.rects)
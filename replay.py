@@ -0,0 +1,144 @@
+""" Records player input into compact binary replays and plays them back
+    headlessly at full speed:
+
+        python replay.py replays/1700000000.replay
+
+    A replay is a header followed by one 4 byte event per set_direction()
+    call: the number of ticks since the previous event and the player number
+    and direction packed into one word. Together with the match seed that is
+    all it takes to reproduce a match exactly.
+
+    Playback only feeds the recorded inputs back in; the AIs aren't run, so
+    an error raised inside an AI won't happen again here. To reproduce one,
+    play the match again from its seed with the same AIs, e.g.
+
+        python simulation.py levels/level1.ini --seed 1234
+
+    AI matches are deterministic given the seed, as long as no JameelAI
+    search runs into its per-move time limit.
+"""
+import argparse
+import os
+import struct
+import time
+
+import game
+import level
+
+MAGIC = 'BSRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBQH')  # magic, version, seed, number of players
+EVENT = struct.Struct('<HH')  # ticks since the previous event, player << 2 | direction
+
+# Special values of the event word
+SKIP = 0xFFFF  # Tick delta too large for one event; just advance the tick
+END = 0xFFFE  # Last event, marks the tick the recording stopped at
+MAX_DELTA = 0xFFFF
+
+class Recorder(object):
+    def __init__(self, f, level_file, seed, num_players):
+        self.file = f
+        self.last_tick = 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, num_players))
+        self.file.write(struct.pack('<H', len(level_file)) + level_file)
+
+    def _write(self, tick, word):
+        delta = tick - self.last_tick
+        while delta > MAX_DELTA:
+            self.file.write(EVENT.pack(MAX_DELTA, SKIP))
+            delta -= MAX_DELTA
+        self.file.write(EVENT.pack(delta, word))
+        self.last_tick = tick
+
+    def record(self, player_number, direction):
+        self._write(game.tick, player_number << 2 | direction)
+
+    def close(self):
+        self._write(game.tick, END)
+        self.file.close()
+
+class Replay(object):
+    def __init__(self, level_file, seed, num_players, events, end_tick):
+        self.level_file = level_file
+        self.seed = seed
+        self.num_players = num_players
+        self.events = events  # (tick, player number, direction) tuples
+        self.end_tick = end_tick
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        magic, version, seed, num_players = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d replay" % (path, VERSION))
+        offset = HEADER.size
+        length, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        level_file = data[offset:offset+length]
+        offset += length
+
+        events = []
+        tick = 0
+        end_tick = None
+        while offset < len(data):
+            delta, word = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            tick += delta
+            if word == END:
+                end_tick = tick
+                break
+            elif word != SKIP:
+                events.append((tick, word >> 2, word & 3))
+        if end_tick is None:
+            # The game was killed before the recording was closed
+            end_tick = tick
+        return cls(level_file, seed, num_players, events, end_tick)
+
+    def play(self):
+        """ Plays the match back without a display or frame limiter. """
+        game.headless = True
+        game.level = level.Level(self.level_file)
+        game.num_players = self.num_players
+        game.init_level(self.seed)
+
+        players = dict((player.player_number, player) for player in game.players)
+        events = iter(self.events)
+        event = next(events, None)
+        while game.tick < self.end_tick:
+            # Input is applied between updates, exactly as it was recorded
+            while event and event[0] == game.tick:
+                players[event[1]].set_direction(event[2])
+                event = next(events, None)
+            game.update()
+
+def start_recording(directory='replays'):
+    """ Starts recording the current match into _directory_. """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%d.replay' % (time.time() * 1000))
+    game.recorder = Recorder(open(path, 'wb'), game.level.config_file, game.match_seed, game.num_players)
+    return path
+
+def stop_recording():
+    if game.recorder:
+        game.recorder.close()
+        game.recorder = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Play back a recorded match headlessly.")
+    parser.add_argument('replay', help="Path to a .replay file")
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+    start_time = time.time()
+    replay.play()
+    elapsed = time.time() - start_time
+
+    print "Replayed %d ticks and %d inputs in %.2fs (%d ticks/s)" % (replay.end_tick, len(replay.events), elapsed, replay.end_tick / max(elapsed, 1e-6))
+    for player in game.players:
+        print "%s: %d kills, %d deaths" % (player.name, len(player.kills), len(player.deaths))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+""" Runs games without a display or frame limiter, using the same rules as the
+    interactive game. Useful for evaluating AI matches on servers without
+    X/SDL:
+
+        python simulation.py levels/level1.ini --ticks 5000
+
+    --snakes plays an arena match with any number of AI snakes, spawned
+    wherever the level has room, to see how the game and the AIs scale:
+
+        python simulation.py levels/level_arena.ini --snakes 100 --batch-size 25
+"""
+import argparse
+import Queue
+import time
+
+import game
+import instrumentation
+import level
+import process
+import replay
+from ai_vincent import VincentAI
+from ai_jason import JasonAI
+from ai_jameel import JameelAI
+
+AI_CLASSES = dict((_class.__name__, _class) for _class in [VincentAI, JasonAI, JameelAI])
+
+# Same line-up as the "AI Demo" game mode
+DEFAULT_AI_CLASSES = [VincentAI, JasonAI, JameelAI, JasonAI]
+ARENA_RANKING = 10  # Players listed after an arena match
+
+def get_line_up(snakes):
+    """ AI classes for an arena of _snakes_ snakes: the default line-up,
+        repeated. """
+    return [DEFAULT_AI_CLASSES[i % len(DEFAULT_AI_CLASSES)] for i in range(snakes)]
+
+class Simulation(object):
+    def __init__(self, lvl, ai_classes=None, seed=None, record_path=None, batch_size=None, think_time=None):
+        self.level = lvl
+        self.ai_classes = ai_classes or DEFAULT_AI_CLASSES
+        self.seed = seed
+        self.record_path = record_path
+        self.batch_size = batch_size
+        self.think_time = think_time
+        self.input_queue = Queue.Queue()
+        self.ai_processes = []  # One AI per player
+        self.steppers = []  # What to step() each tick in their place
+        self.ticks = 0
+
+    def setup(self):
+        game.headless = True
+        game.level = self.level
+        game.num_players = len(self.ai_classes)
+        game.init_level(self.seed)
+        game.init_shared_state()
+        if self.record_path:
+            game.recorder = replay.Recorder(open(self.record_path, 'wb'), self.level.config_file, game.match_seed, game.num_players)
+
+        if len(game.players) < len(self.ai_classes):
+            raise ValueError("%s has room for %d snakes, not %d" % (self.level.config_file, len(game.players), len(self.ai_classes)))
+        self.ai_processes, self.steppers = process.create_ais(self.ai_classes, game.shared_snapshot, self.input_queue, self.batch_size, self.think_time)
+        self.ticks = 0
+
+    def process_input(self):
+        while True:
+            try:
+                commands = self.input_queue.get_nowait()
+            except Queue.Empty:
+                break
+            game.apply_commands(commands)
+
+    def tick(self):
+        self.process_input()
+
+        # AIs are stepped exactly as in the interactive game: JasonAI every
+        # third tick, everyone else on every tick.
+        for stepper in self.steppers:
+            if not isinstance(stepper, JasonAI) or self.ticks % 3 == 2:
+                stepper.step()
+
+        game.update()
+        game.sync_shared_state()
+        self.ticks += 1
+
+    def run(self, max_ticks):
+        """ Plays until someone wins or _max_ticks_ have passed. Returns the
+            winners, if any. """
+        self.setup()
+        while self.ticks < max_ticks:
+            self.tick()
+            winners = game.get_winners()
+            if winners:
+                return winners
+        return []
+
+    def stop(self):
+        replay.stop_recording()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a headless AI match.")
+    parser.add_argument('level', help="Path to a level file, e.g. levels/level1.ini")
+    parser.add_argument('--ticks', type=int, default=10000, help="Maximum number of ticks to play")
+    parser.add_argument('--seed', type=int, help="Seed for the game's random generator")
+    parser.add_argument('--record', help="Record the match's input to this replay file")
+    parser.add_argument('--ai', action='append', choices=sorted(AI_CLASSES), help="AI of the next player, e.g. to replay a tournament match (default: the AI Demo's line-up)")
+    parser.add_argument('--snakes', type=int, help="Number of AI snakes (default: the AI Demo's four)")
+    parser.add_argument('--batch-size', type=int, help="Step the AIs in batches of this many, sharing one copy of the state")
+    parser.add_argument('--think-time', type=float, help="Seconds an AI with a search deadline (JameelAI) may think per move")
+    args = parser.parse_args()
+
+    if args.ai:
+        ai_classes = [AI_CLASSES[name] for name in args.ai]
+    else:
+        ai_classes = get_line_up(args.snakes) if args.snakes else None
+    simulation = Simulation(level.Level(args.level), ai_classes, seed=args.seed, record_path=args.record, batch_size=args.batch_size, think_time=args.think_time)
+    start_time = time.time()
+    winners = simulation.run(args.ticks)
+    elapsed = time.time() - start_time
+    simulation.stop()
+
+    print "Played %d ticks in %.2fs (%d ticks/s)" % (simulation.ticks, elapsed, simulation.ticks / max(elapsed, 1e-6))
+    budget_ms = 1000.0 / game.ticks_per_second
+    if len(game.players) <= len(DEFAULT_AI_CLASSES):
+        for player in game.players:
+            print "%s: %d kills, %d deaths" % (player.name, len(player.kills), len(player.deaths))
+        for player, proc in zip(game.players, simulation.ai_processes):
+            print instrumentation.format_report("%s (%s)" % (player.name, type(proc).__name__), proc.stats, budget_ms)
+    else:
+        # Too many snakes to list; show the best and pool the AIs by kind
+        ranking = sorted(game.players, key=lambda player: -len(player.kills))
+        for player in ranking[:ARENA_RANKING]:
+            print "%s: %d kills, %d deaths" % (player.name, len(player.kills), len(player.deaths))
+        if len(ranking) > ARENA_RANKING:
+            print "... and %d more" % (len(ranking) - ARENA_RANKING)
+        stats = {}
+        for proc in simulation.ai_processes:
+            stats.setdefault(type(proc).__name__, []).append(proc.stats)
+        for name, stats_list in sorted(stats.items()):
+            print instrumentation.format_report("%s x%d" % (name, len(stats_list)), instrumentation.merge(stats_list), budget_ms)
+    if winners:
+        print "Winner: %s" % ', '.join(w.name for w in winners)
+
+if __name__ == '__main__':
+    main()
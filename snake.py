@@ -1,14 +1,17 @@
-from collections import deque
 import multiprocessing
 import Queue
-import time
 
 import pygame
 from pygame.locals import *
 
+import fonts
 import game
-import game_objects
+import instrumentation
 import level
+import profiler
+import replay
+from renderer import DirtyRenderer
+from timing import monotonic
 
 import process
 from ai_vincent import VincentAI
@@ -16,10 +19,31 @@ from ai_jason import JasonAI
 from ai_jameel import JameelAI
 ai_classes = [VincentAI, JasonAI, JameelAI]
 
+MAX_TICKS_PER_FRAME = 5  # Ticks a frame may catch up on before the game slows down
+FAST_FORWARD_KEY = K_TAB  # Hold to run the game faster
+FAST_FORWARD_SPEED = 4
+FOLLOW_KEY = K_c  # Moves the view on to the next snake, on boards larger than the window
+SCOREBOARD_PLAYERS = 6  # Most players the scoreboard and the win summary have room for
+
+def steer(key):
+    """ Turns the snake _key_ is bound to, or fires if it's already heading
+        that way. """
+    for player_index, keys in game.player_controls.items():
+        if key in keys and player_index < game.num_players:
+            game.players[player_index].set_direction(keys.index(key))
+            return
+
+def get_leaders():
+    """ The players to show on the scoreboard: all of them if they fit,
+        otherwise those with the most kills (and then the fewest deaths). """
+    if len(game.players) <= SCOREBOARD_PLAYERS:
+        return game.players
+    return sorted(game.players, key=lambda player: (-len(player.kills), len(player.deaths)))[:SCOREBOARD_PLAYERS]
+
 class Menu():
     def __init__(self, options, spacing=50):
         self.options = options
-        self.font = pygame.font.SysFont("verdana", 30)
+        self.font = fonts.get_font('menu')
         self.font_color = pygame.Color(255, 255, 255)
         self.selector_color = pygame.Color(255, 255, 255)
         self.selector_padding = 20
@@ -38,9 +62,7 @@ class Menu():
 
         title_text = game.NAME
         title_color = pygame.Color(0, 255, 0)
-        title_font = pygame.font.SysFont("impact", 70)
         title_top = 100
-        subtitle_font = pygame.font.SysFont("georgia", 15)
         subtitle_text = "By Vincent and Jason"
         subtitle_top = 190
 
@@ -71,18 +93,18 @@ class Menu():
             game.screen.blit(background, (0, 0))
 
             # Draw title
-            title = title_font.render(title_text, 1, title_color)
+            title = fonts.render('menu_title', title_text, title_color)
             title_pos = title.get_rect(centerx = game.WINDOW_WIDTH/2, y = title_top)
             game.screen.blit(title, title_pos)
 
             # Draw subtitle
-            subtitle = subtitle_font.render(subtitle_text, 1, title_color)
+            subtitle = fonts.render('menu_subtitle', subtitle_text, title_color)
             subtitle_pos = subtitle.get_rect(centerx = game.WINDOW_WIDTH/2, y = subtitle_top)
             game.screen.blit(subtitle, subtitle_pos)
 
             # Draw menu options
             for i, option in enumerate(self.options):
-                text = self.font.render(option, 1, self.font_color)
+                text = fonts.render('menu', option, self.font_color)
                 text_position = text.get_rect(centerx = game.WINDOW_WIDTH/2, y = menu_top + menu_item_height * i)
                 game.screen.blit(text, text_position)
 
@@ -96,22 +118,33 @@ class Menu():
 
 def main_loop():
     pygame.init()
+    game.init_display()
+    fonts.load_fonts()
     pygame.display.set_caption(game.NAME)
     clock = pygame.time.Clock()
 
     background = pygame.Surface(game.screen.get_size()).convert()
     background.fill(pygame.Color(0, 0, 0))
 
+    renderer = None
+    if game.dirty_rendering:
+        renderer = DirtyRenderer(game.screen)
+        renderer.add_hud_rect((0, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT, game.WINDOW_WIDTH, game.SCOREBOARD_HEIGHT))
+        renderer.add_hud_rect(game.log_screen.get_rect())
+        if game.frame_profiler:
+            renderer.add_hud_rect(profiler.get_hud_rect())
+
     input_queue = multiprocessing.Queue()
 
     while True:
         # Choose player mode
-        options = ["AI Demo", "Two players", "Three players", "Four players"]
+        options = ["AI Demo", "Two players", "Three players", "Four players", "Arena"]
         selection = Menu(options).show()
         if selection is False:
             return
         else:
-            game.num_players = selection + 1
+            arena = options[selection] == "Arena"
+            game.num_players = game.arena_snakes if arena else selection + 1
 
         # Choose level
         levels = level.get_levels()
@@ -121,9 +154,10 @@ def main_loop():
         else:
             game.level = levels[selection]
 
-            # If single player, add an AI player
-            if game.num_players == 1:
-                game.num_players = 4
+            # If single player, add an AI player; an arena is all AIs
+            if game.num_players == 1 or arena:
+                if not arena:
+                    game.num_players = 4
                 game.init_level()
 
                 ai_engines = []
@@ -132,119 +166,156 @@ def main_loop():
                 ai_engines.append(ai_classes[1])
                 ai_engines.append(ai_classes[2])
                 ai_engines.append(ai_classes[1])
-                shared_apples = multiprocessing.Array(process.GameObject,
-                        list((apple.x, apple.y) for apple in game.apples))
-                shared_players = multiprocessing.Array(process.MovableGameObject,
-                        list(((player.x, player.y), player.direction)
-                            for player in game.players))
-                ai_processes = [_class(player_index=i, board=game.shared_board, players=shared_players, apples=shared_apples, player=game.players[i], args=(input_queue,)) for i, _class in enumerate(ai_engines)]
+                ai_engines = [ai_engines[i % len(ai_engines)] for i in range(len(game.players))]
+                game.init_shared_state()
+                ai_processes, ai_steppers = process.create_ais(ai_engines, game.shared_snapshot, input_queue, game.ai_batch_size)
                 # Load threaded AI
                 if game.use_multiprocessing:
-                    map(lambda proc: proc.start(), ai_processes)
-                game.players[1].name = 'The Spirit of AI'
-                game.players[1].name = 'Bebe Bot'
-                game.players[2].name = 'The Will of AI'
-                game.players[3].name = 'Bot Choy'
+                    for stepper in ai_steppers:
+                        if isinstance(stepper, multiprocessing.Process):
+                            stepper.start()
+                if not arena:
+                    game.players[1].name = 'The Spirit of AI'
+                    game.players[1].name = 'Bebe Bot'
+                    game.players[2].name = 'The Will of AI'
+                    game.players[3].name = 'Bot Choy'
             else:
                 game.init_level()
+                game.init_shared_state()
+                ai_processes = []
+                ai_steppers = []
 
         # Start game loop
         return_to_menu = False
         game_status = None
-        ai_frame_count = 1
-        start_time = time.time()
+        if game.record_replays:
+            replay.start_recording()
 
+        frame_profiler = profiler.FrameProfiler() if game.frame_profiler else None
+        tick_interval = 1.0 / game.ticks_per_second
+        lag = 0.0  # Game time the simulation is behind the clock
+        last_time = monotonic()
         while not return_to_menu:
             clock.tick(game.frames_per_second)
-
-            while True:
-                # Process key presses from AI threads.
-                # Pulls values from input queue, creates pygame Events, and
-                # submits to event queue.
-                try:
-                    pygame.event.post(pygame.event.Event(KEYDOWN, {'key':
-                        input_queue.get_nowait(),}))
-                except Queue.Empty, qe:
-                    break
-
-            # Process non multiprocessing AI moves
-            if not game.use_multiprocessing:
-                # map(lambda proc: proc.execute(), ai_processes)
-                for proc in ai_processes:
-                    if not isinstance(proc, JasonAI):
-                        proc.execute()
-
-                if ai_frame_count < 3:
-                    ai_frame_count += 1
-                else:
-                    for proc in ai_processes:
-                        if isinstance(proc, JasonAI):
-                            proc.execute()
-                    ai_frame_count = 1
+            if frame_profiler:
+                frame_profiler.mark('wait')
 
             # Get input
             for event in pygame.event.get():
                 if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
                     return_to_menu = True
+                    replay.stop_recording()
+                    if game.ai_stats:
+                        for player, proc in zip(game.players, ai_processes):
+                            print instrumentation.format_report(player.name, proc.stats, 1000.0 / game.ticks_per_second)
+                    if frame_profiler:
+                        print frame_profiler.format_summary(1000.0 / game.frames_per_second)
                     # Shutdown all AI processes
                     if game.use_multiprocessing:
-                        map(lambda proc: proc.shutdown(), ai_processes)
+                        for stepper in ai_steppers:
+                            if isinstance(stepper, multiprocessing.Process):
+                                stepper.shutdown()
                     break
 
                 if event.type == KEYDOWN:
                     if event.key == K_SPACE:
                         game.players[0].grow = True
                     elif event.key == K_RETURN and game_status == "win":
+                        replay.stop_recording()
+                        if frame_profiler:
+                            print frame_profiler.format_summary(1000.0 / game.frames_per_second)
+                            frame_profiler = profiler.FrameProfiler()
                         game.init_level()
+                        if game.record_replays:
+                            replay.start_recording()
                         game_status = None
                         continue
-                    elif event.key in game.player_controls[0]:
-                        game.players[0].set_direction(game.player_controls[0].index(event.key))
-                    elif event.key in game.player_controls[1] and game.num_players > 1:
-                        game.players[1].set_direction(game.player_controls[1].index(event.key))
-                    elif event.key in game.player_controls[2] and game.num_players > 2:
-                        game.players[2].set_direction(game.player_controls[2].index(event.key))
-                    elif event.key in game.player_controls[3] and game.num_players > 3:
-                        game.players[3].set_direction(game.player_controls[3].index(event.key))
-
-            # Update effects
-            for effect in game.effects:
-                effect.update()
-
-            # Update game
-            game.update()
-
-            # Update shared board
-            for i, v in enumerate([(apple.x, apple.y) for apple in game.apples]):
-                shared_apples[i] = v
-
-            for i, v in enumerate([((player.x, player.y), player.direction, player.get_length()) for player in game.players]):
-                shared_players[i] = v
+                    elif event.key == FOLLOW_KEY and game.players:
+                        target = game.viewport.target
+                        index = game.players.index(target) + 1 if target in game.players else 0
+                        game.viewport.follow(game.players[index % len(game.players)])
+                    else:
+                        steer(event.key)
+            if frame_profiler:
+                frame_profiler.mark('input')
+
+            # Run as many ticks as the clock says are due, however long the
+            # frames take. If we fall too far behind, the game slows down
+            # instead of never catching up. Everything that affects play
+            # counts ticks rather than seconds, so neither the frame rate
+            # nor fast-forward changes how a match goes.
+            now = monotonic()
+            speed = FAST_FORWARD_SPEED if pygame.key.get_pressed()[FAST_FORWARD_KEY] else 1
+            lag = min(lag + (now - last_time) * speed, MAX_TICKS_PER_FRAME * speed * tick_interval)
+            last_time = now
+            while lag >= tick_interval:
+                lag -= tick_interval
+
+                # Apply the commands AIs sent
+                while True:
+                    try:
+                        game.apply_commands(input_queue.get_nowait())
+                    except Queue.Empty, qe:
+                        break
+                if frame_profiler:
+                    frame_profiler.mark('input')
+
+                # Step the AIs that don't run in a process of their own,
+                # JasonAI every third tick and everyone else on every tick
+                for stepper in ai_steppers:
+                    if game.use_multiprocessing and isinstance(stepper, multiprocessing.Process):
+                        continue
+                    if not isinstance(stepper, JasonAI) or game.tick % 3 == 2:
+                        stepper.step()
+                if frame_profiler:
+                    frame_profiler.mark('ai')
+
+                # Update effects
+                game.update_effects()
+                if frame_profiler:
+                    frame_profiler.mark('effects')
+
+                # Update game
+                game.update()
+                if frame_profiler:
+                    frame_profiler.mark('update')
+
+                # Update shared board
+                game.sync_shared_state()
+                if frame_profiler:
+                    frame_profiler.mark('sync')
 
             # Draw the screen
-            game.screen.blit(background, (0, 0))
-            game.draw()
-            for effect in game.effects:
-                effect.draw()
+            game.viewport.update()
+            if renderer:
+                renderer.draw()
+            else:
+                game.screen.blit(background, (0, 0))
+                game.draw()
+                for effect in game.effects:
+                    effect.draw()
+            if frame_profiler:
+                frame_profiler.mark('draw')
 
             # Draw scoreboard
             score_icon_size = 30
             score_width = 55
             score_margin = 120
-            all_score_widths = game.num_players * score_width + (game.num_players-1) * score_margin
+            leaders = get_leaders()
+            all_score_widths = len(leaders) * score_width + (len(leaders)-1) * score_margin
             score_x = (game.WINDOW_WIDTH - all_score_widths)/2
             score_y = game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT + (game.SCOREBOARD_HEIGHT-score_icon_size)/2
-            for i, player in enumerate(game.players):
+            for i, player in enumerate(leaders):
                 icon = pygame.Rect(score_x + i*(score_width+score_margin), score_y, score_icon_size, score_icon_size)
                 text = str(len(player.kills))
 
-                score = pygame.font.SysFont('impact', 30).render(text, 1, pygame.Color("white"))
+                score = fonts.render('score', text, pygame.Color("white"))
                 score_pos = score.get_rect(left = icon.right + 10, centery = icon.centery)
 
                 game.screen.blit(score, score_pos)
                 pygame.draw.rect(game.screen, player.color, icon)
 
-            runtime = int(time.time() - start_time)
+            runtime = game.tick // game.ticks_per_second  # Game time
             runtime_min = runtime // 60
             runtime_sec = runtime % 60
             if runtime_min < 10:
@@ -253,29 +324,32 @@ def main_loop():
                 runtime_sec = "0" + str(runtime_sec)
             runtime_text = "%s : %s" % (runtime_min, runtime_sec)
 
-            time_text = pygame.font.SysFont('impact', 24).render(runtime_text, 1, pygame.Color("white"))
+            time_text = fonts.render('timer', runtime_text, pygame.Color("white"))
             time_pos = time_text.get_rect(x = game.WINDOW_WIDTH - 95, y = game.WINDOW_HEIGHT - 54)
             game.screen.blit(time_text, time_pos)
+            if frame_profiler:
+                frame_profiler.mark('scoreboard')
 
             # Check for the win condition
-            winners = filter(lambda p: len(p.kills) >= game.level.kills_to_win, game.players)
+            winners = game.get_winners()
             if winners:
                 game_status = 'win'
+                if renderer:
+                    # The summary covers most of the screen
+                    renderer.invalidate()
 
                 # Check for ties
-                least_deaths = min(len(w.deaths) for w in winners)
-                winners = filter(lambda w: len(w.deaths) == least_deaths, winners)
                 if len(winners) > 1:
-                    title = pygame.font.SysFont("impact", 100).render("Draw!", 1, pygame.Color("white"))
+                    title = fonts.render('win_title', "Draw!", pygame.Color("white"))
                 else:
-                    title = pygame.font.SysFont("impact", 100).render(winners[0].name + " wins!", 1, pygame.Color("white"))
+                    title = fonts.render('win_title', winners[0].name + " wins!", pygame.Color("white"))
 
                 # Draw title
                 title_pos = title.get_rect(centerx = game.WINDOW_WIDTH/2, centery = 200)
                 game.screen.blit(title, title_pos)
 
                 # Draw subtitle
-                subtext = pygame.font.SysFont("verdana", 15).render("Press [ENTER] to play again, or [ESC] to return to the main menu.", 1, pygame.Color("white"))
+                subtext = fonts.render('win_subtitle', "Press [ENTER] to play again, or [ESC] to return to the main menu.", pygame.Color("white"))
                 subtext_pos = subtext.get_rect(centerx = game.WINDOW_WIDTH/2, y = title_pos.bottom + 10)
                 game.screen.blit(subtext, subtext_pos)
 
@@ -283,51 +357,63 @@ def main_loop():
                 header_width = 200
                 header_height = 30
                 header_margin = 0
-                header_x = (game.WINDOW_WIDTH - header_width * game.num_players) / 2
+                header_x = (game.WINDOW_WIDTH - header_width * len(leaders)) / 2
                 header_y = subtext_pos.bottom + 50
                 cell_margin = 20
 
-                for i, player in enumerate(game.players):
+                for i, player in enumerate(leaders):
                     # Draw header box
                     header = pygame.Rect(header_x + (header_width+header_margin)*i, header_y, header_width, header_height)
                     pygame.draw.rect(game.screen, player.color, header)
 
                     # Draw header text
-                    text = pygame.font.SysFont("arial", 16, bold=True).render(player.name, 1, pygame.Color("white"))
+                    text = fonts.render('win_header', player.name, pygame.Color("white"))
                     text_pos = text.get_rect(centerx = header.centerx, centery = header.centery)
                     game.screen.blit(text, text_pos)
 
                     # Draw death summary
                     s = "Total deaths: " + str(len(player.deaths))
-                    death_summary_font = pygame.font.SysFont("arial", 14, bold=True).render(s, 1, pygame.Color("white"))
+                    death_summary_font = fonts.render('win_total', s, pygame.Color("white"))
                     death_summary_pos = death_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin)
                     game.screen.blit(death_summary_font, death_summary_pos)
 
+                    death_summary = player.get_death_summary()
                     strings = []
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.SnakePart) and c.player is not player, player.deaths))) + " by collision")
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.Missile) and c.player is not player, player.deaths))) + " by missile")
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.Wall), player.deaths))) + " by wall")
-                    strings.append(str(len(filter(lambda c: (isinstance(c, game_objects.Missile) and c.player is player) or (isinstance(c, game_objects.SnakePart) and c.player is player), player.deaths))) + " by suicide")
+                    for cause in ('collision', 'missile', 'wall', 'suicide'):
+                        strings.append(str(death_summary[cause]) + " by " + cause)
 
                     for i, s in enumerate(strings):
-                        text = pygame.font.SysFont("arial", 13).render(s, 1, pygame.Color("white"))
+                        text = fonts.render('win_detail', s, pygame.Color("white"))
                         text_pos = text.get_rect(centerx = header.centerx, centery = death_summary_pos.bottom + (i+1)*cell_margin)
                         game.screen.blit(text, text_pos)
 
                     # Draw kill summary
                     s = "Total kills: " + str(len(player.kills))
-                    kill_summary_font = pygame.font.SysFont("arial", 14, bold=True).render(s, 1, pygame.Color("white"))
+                    kill_summary_font = fonts.render('win_total', s, pygame.Color("white"))
                     kill_summary_pos = kill_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin + 130)
                     game.screen.blit(kill_summary_font, kill_summary_pos)
 
                     for i, opponent in enumerate(player.kills):
-                        text = pygame.font.SysFont("arial", 13).render(opponent.name, 1, opponent.color)
+                        text = fonts.render('win_detail', opponent.name, opponent.color)
                         text_pos = text.get_rect(centerx = header.centerx, centery = kill_summary_pos.bottom + (i+1)*cell_margin)
                         game.screen.blit(text, text_pos)
+            if frame_profiler:
+                frame_profiler.mark('win')
 
+                # Draw the profiler's HUD
+                frame_profiler.count('effects', len(game.effects))
+                frame_profiler.count('missiles', len(game.missiles))
+                frame_profiler.draw()
+                frame_profiler.mark('profiler')
 
             # Display!
-            pygame.display.flip()
+            if renderer:
+                renderer.update_display()
+            else:
+                pygame.display.flip()
+            if frame_profiler:
+                frame_profiler.mark('flip')
+                frame_profiler.end_frame()
 
 if __name__ == '__main__':
     main_loop()
@@ -0,0 +1,220 @@
+""" Game state shared with the AI processes.
+
+    Once per tick the main loop publishes a frame holding everything the AIs
+    read: the board, players, apples, missiles and the per-tick maps (apple
+    distances, missile arrival times and snake head reach). AIs copy the
+    newest frame into their own memory before they think, so nothing changes
+    under them while they do.
+
+    Frames are kept in two slots of shared memory used in turn: tick n+1 is
+    written into the slot that doesn't hold tick n, so a reader copying the
+    latest frame is never racing the writer unless it is a whole tick late.
+    Each slot carries the sequence number of the frame it holds, which is set
+    to WRITING while the main loop fills it in; a reader that sees it change
+    during its copy just copies again. Neither side takes a lock to read or
+    write a frame; the only lock is the condition AIs sleep on between
+    frames, which the main loop takes briefly to wake them.
+
+    The missiles come last in a frame and readers only copy the ones in
+    flight, so room for a full board of them costs nothing until it's used.
+"""
+import ctypes
+import multiprocessing
+from ctypes import Structure, c_char, c_int, c_long
+
+import numpy
+
+WRITING = -1  # Sequence number of a slot being filled in
+
+class GameObject(Structure):
+    _fields_ = [('x', c_int), ('y', c_int)]
+
+    def __repr__(self):
+        return '(%d, %d)' % (self.x, self.y,)
+
+class MovableGameObject(Structure):
+    _anonymous_ = ('game_object',)
+    _fields_ = [('game_object', GameObject), ('direction', c_int),
+            ('length', c_int),]
+
+    def __repr__(self):
+        return '(%d, %d) %d' % (self.x, self.y, self.direction,)
+
+_frame_types = {}
+
+def get_max_missiles(width, height):
+    """ Most missiles that can be in flight on a width x height board: each
+        one takes up a cell of its own. """
+    return width * height
+
+def get_frame_type(width, height, max_players, max_apples):
+    """ Returns the ctypes Structure holding one frame for a width x height
+        board, up to _max_players_ players and _max_apples_ apples. Per-cell
+        arrays are flat, indexed x*height + y like board.Board's grids, and
+        each missile is an (x, y, direction, owner) row. """
+    frame_type = _frame_types.get((width, height, max_players, max_apples))
+    if frame_type is None:
+        size = width * height
+        max_missiles = get_max_missiles(width, height)
+
+        class Frame(Structure):
+            _fields_ = [
+                ('sequence', c_long),
+                ('tick', c_long),
+                ('board', (c_char * height) * width),
+                ('player_count', c_int),
+                ('players', MovableGameObject * max_players),
+                ('apple_count', c_int),
+                ('apples', GameObject * max_apples),
+                ('apple_distances', c_int * size),
+                ('missile_ticks', c_int * size),
+                ('head_reach', c_int * size),
+                ('head_owner', c_int * size),
+                ('rival_reach', c_int * size),
+                ('missile_count', c_int),
+                ('missiles', (c_int * 4) * max_missiles),  # Keep last, see SnapshotReader.read()
+            ]
+
+        frame_type = _frame_types[width, height, max_players, max_apples] = Frame
+    return frame_type
+
+class SharedSnapshot(object):
+    """ The writing side, owned by the main loop. Create it before starting
+        the AI processes so they inherit the shared memory. """
+    ARRAYS = ('board', 'missiles', 'apple_distances', 'missile_ticks', 'head_reach', 'head_owner', 'rival_reach')
+
+    def __init__(self, width, height, max_players, max_apples):
+        self.width = width
+        self.height = height
+        self.max_players = max_players
+        self.max_apples = max_apples
+        self.max_missiles = get_max_missiles(width, height)
+        self.frame_type = get_frame_type(width, height, max_players, max_apples)
+        self.frames = multiprocessing.RawArray(self.frame_type, 2)
+        self.sequence = multiprocessing.RawValue(c_long, 0)
+        self.published = multiprocessing.Condition()  # Notified after each frame
+
+        # numpy views of each slot's arrays, for writing them in bulk
+        self._views = []
+        for slot in range(2):
+            frame = self.frames[slot]
+            self._views.append(dict((name, numpy.frombuffer(getattr(frame, name), dtype=numpy.uint8 if name == 'board' else numpy.int32))
+                    for name in self.ARRAYS))
+            self._views[slot]['missiles'].shape = (self.max_missiles, 4)
+        self._slot_boards = [None, None]  # Board each slot's cells were last written from
+        self._last_dirty = set()
+
+    def publish(self, tick, board, players, apples, missiles, apple_distances, missile_ticks, head_reach, head_owner, rival_reach):
+        """ Writes a frame and makes it the latest.
+
+            _players_ are ((x, y), direction, length) and _apples_ (x, y)
+            tuples, _missiles_ is the game_objects.Missiles in flight and the
+            maps are flat numpy arrays. Raises ValueError if there are more
+            apples or missiles than the frame has room for.
+
+            Only the board cells changed since the slot was last written (two
+            ticks ago) are copied, unless the board itself was replaced. """
+        sequence = self.sequence.value + 1
+        slot = sequence % 2
+        frame = self.frames[slot]
+        views = self._views[slot]
+        frame.sequence = WRITING
+        frame.tick = tick
+
+        dirty = board.take_dirty()
+        if self._slot_boards[slot] is board:
+            changed = dirty | self._last_dirty
+            if changed:
+                board.write_chars(views['board'], numpy.fromiter(changed, dtype=numpy.intp, count=len(changed)))
+        else:
+            board.write_chars(views['board'])
+            self._slot_boards[slot] = board
+        self._last_dirty = dirty
+
+        players = players[:self.max_players]
+        frame.player_count = len(players)
+        for i, player in enumerate(players):
+            frame.players[i] = player
+        if len(apples) > self.max_apples:
+            raise ValueError("%d apples don't fit a snapshot sized for %d" % (len(apples), self.max_apples))
+        frame.apple_count = len(apples)
+        for i, apple in enumerate(apples):
+            frame.apples[i] = apple
+
+        count = len(missiles)
+        if count > self.max_missiles:
+            raise ValueError("%d missiles don't fit a snapshot sized for %d" % (count, self.max_missiles))
+        frame.missile_count = count
+        rows = views['missiles']
+        rows[:count, 0] = missiles.x[:count]
+        rows[:count, 1] = missiles.y[:count]
+        rows[:count, 2] = missiles.direction[:count]
+        rows[:count, 3] = missiles.owner[:count]
+
+        views['apple_distances'][:] = apple_distances
+        views['missile_ticks'][:] = missile_ticks
+        views['head_reach'][:] = head_reach
+        views['head_owner'][:] = head_owner
+        views['rival_reach'][:] = rival_reach
+
+        frame.sequence = sequence
+        self.sequence.value = sequence
+        self.wake()
+
+    def wake(self):
+        """ Wakes every reader blocked in SnapshotReader.wait(). """
+        with self.published:
+            self.published.notify_all()
+
+class SnapshotReader(object):
+    """ The reading side, used by an AI or a batch of them: read() copies the
+        latest frame into the private _frame_, and lists its _players_,
+        _apples_ and _missiles_. """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.frame = snapshot.frame_type()
+        self._missiles_offset = snapshot.frame_type.missiles.offset
+        self._missile_size = ctypes.sizeof(c_int * 4)
+        self.sequence = 0
+        self.players = []
+        self.apples = []
+        self.missiles = []
+
+    def read(self):
+        """ Copies the newest frame into _frame_. Returns False, leaving
+            _frame_ alone, if it's the one copied last time. """
+        shared = self.snapshot
+        while True:
+            sequence = shared.sequence.value
+            if sequence == self.sequence:
+                return False
+            source = shared.frames[sequence % 2]
+            # Everything up to the missiles, plus the ones in flight
+            size = self._missiles_offset + min(source.missile_count, shared.max_missiles) * self._missile_size
+            ctypes.memmove(ctypes.addressof(self.frame), ctypes.addressof(source), size)
+            # The copy is whole if the slot held this frame both before and
+            # after it, and so did the missile count it was sized by
+            if self.frame.sequence == sequence and source.sequence == sequence:
+                self.sequence = sequence
+                frame = self.frame
+                self.players = frame.players[:frame.player_count]
+                self.apples = frame.apples[:frame.apple_count]
+                self.missiles = self.get_missiles()
+                return True
+
+    def wait(self, timeout=None):
+        """ Blocks until a frame newer than the last one read is published,
+            or until _timeout_ seconds pass or SharedSnapshot.wake() is
+            called. Returns whether there is a new frame. """
+        shared = self.snapshot
+        with shared.published:
+            # Checked under the condition's lock, so a frame published after
+            # this check can't notify before we wait
+            if shared.sequence.value == self.sequence:
+                shared.published.wait(timeout)
+        return shared.sequence.value != self.sequence
+
+    def get_missiles(self):
+        """ The missiles in flight as (x, y, direction, owner) tuples. """
+        frame = self.frame
+        return [tuple(row) for row in frame.missiles[:frame.missile_count]]
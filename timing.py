@@ -0,0 +1,43 @@
+""" A monotonic clock for deadlines.
+
+    time.time() follows the wall clock, which can jump when the system time is
+    adjusted, and Python 2 has no time.monotonic(), so read CLOCK_MONOTONIC
+    through ctypes where we can and fall back to time.time() elsewhere.
+"""
+import ctypes
+import ctypes.util
+import sys
+import time
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _load_clock_gettime():
+    clock_id = 6 if sys.platform == 'darwin' else 1  # CLOCK_MONOTONIC
+    for name in ('c', 'rt'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        timespec = _Timespec()
+        if clock_gettime(clock_id, ctypes.byref(timespec)) == 0:
+            return clock_gettime, clock_id
+    return None, None
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    _clock_gettime, _clock_id = _load_clock_gettime()
+    if _clock_gettime:
+        _timespec = _Timespec()
+        _timespec_ref = ctypes.byref(_timespec)
+
+        def monotonic():
+            """ Seconds since an arbitrary point, never going backwards. """
+            _clock_gettime(_clock_id, _timespec_ref)
+            return _timespec.tv_sec + _timespec.tv_nsec * 1e-9
+    else:
+        monotonic = time.time
@@ -0,0 +1,201 @@
+""" Plays many headless AI matches across every level on a process pool and
+    rates the AIs against each other:
+
+        python tournament.py --matches 200 --processes 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import traceback
+from collections import defaultdict
+
+import game
+import level
+import simulation
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 24.0
+BOOTSTRAP_SAMPLES = 200
+DEATH_CAUSES = ('collision', 'missile', 'wall', 'suicide')
+
+def init_worker():
+    # The AIs print on every death; keep worker output quiet
+    sys.stdout = open(os.devnull, 'w')
+
+def play_match(match):
+    """ Plays a single match and returns its result as a plain dict, so it can
+        be sent back from a worker process. A match an AI crashed is returned
+        with its traceback instead of its players, so one bad match doesn't
+        stop the tournament. """
+    index, level_file, lineup, seed, max_ticks, think_time = match
+    sim = simulation.Simulation(level.Level(level_file),
+            [simulation.AI_CLASSES[name] for name in lineup], seed=seed, think_time=think_time)
+    try:
+        winners = sim.run(max_ticks)
+    except Exception:
+        return {
+            'index': index,
+            'level': level_file,
+            'seed': seed,
+            'lineup': lineup,
+            'ticks': sim.ticks,
+            'crashed': True,
+            'traceback': traceback.format_exc(),
+        }
+
+    return {
+        'index': index,
+        'level': level_file,
+        'seed': seed,
+        'lineup': lineup,
+        'ticks': sim.ticks,
+        'crashed': False,
+        'players': [{
+            'ai': lineup[i],
+            'kills': len(player.kills),
+            'deaths': player.get_death_summary(),
+            'winner': player in winners,
+        } for i, player in enumerate(game.players)],
+    }
+
+def schedule_matches(num_matches, ai_names, level_files, seats, seed, max_ticks, think_time=None):
+    """ Spreads matches evenly over the levels, rotating the AIs through the
+        seats so no AI always gets the same spawn point. """
+    rng = random.Random(seed)
+    matches = []
+    for i in range(num_matches):
+        lineup = [ai_names[(i + seat) % len(ai_names)] for seat in range(seats)]
+        level_file = level_files[i % len(level_files)]
+        matches.append((i, level_file, lineup, rng.getrandbits(32), max_ticks, think_time))
+    return matches
+
+def placement_score(player):
+    """ Mirrors the win condition: more kills first, then fewer deaths. """
+    return (player['kills'], -sum(player['deaths'].values()))
+
+def rate(results, ai_names):
+    """ Multiplayer Elo: every match counts as a game between each pair of
+        seats held by different AIs. """
+    ratings = dict((name, INITIAL_RATING) for name in ai_names)
+    for result in results:
+        players = result['players']
+        deltas = defaultdict(float)
+        for i, a in enumerate(players):
+            for b in players[i+1:]:
+                if a['ai'] == b['ai']:
+                    continue
+                score_a, score_b = placement_score(a), placement_score(b)
+                actual = 1.0 if score_a > score_b else 0.5 if score_a == score_b else 0.0
+                expected = 1.0 / (1.0 + 10 ** ((ratings[b['ai']] - ratings[a['ai']]) / 400.0))
+                change = K_FACTOR / (len(players) - 1) * (actual - expected)
+                deltas[a['ai']] += change
+                deltas[b['ai']] -= change
+        for name, delta in deltas.items():
+            ratings[name] += delta
+    return ratings
+
+def confidence_intervals(results, ai_names, seed, samples=BOOTSTRAP_SAMPLES):
+    """ 95% bootstrap intervals for each AI's rating. """
+    rng = random.Random(seed)
+    sampled = defaultdict(list)
+    for i in range(samples):
+        resample = [results[rng.randrange(len(results))] for result in results]
+        for name, rating in rate(resample, ai_names).items():
+            sampled[name].append(rating)
+    intervals = {}
+    for name, values in sampled.items():
+        values.sort()
+        intervals[name] = (values[int(len(values) * 0.025)], values[int(len(values) * 0.975) - 1])
+    return intervals
+
+def summarize(results, ai_names, seed):
+    """ Rates the AIs on the matches that finished; crashed matches are
+        only listed. """
+    crashed = [result for result in results if result['crashed']]
+    results = [result for result in results if not result['crashed']]
+    if not results:
+        return {'matches': 0, 'mean_ticks': 0.0, 'ais': {}, 'crashed': crashed}
+    ratings = rate(results, ai_names)
+    intervals = confidence_intervals(results, ai_names, seed)
+
+    stats = dict((name, {'seats': 0, 'wins': 0, 'kills': 0, 'deaths': dict((c, 0) for c in DEATH_CAUSES)}) for name in ai_names)
+    for result in results:
+        for player in result['players']:
+            s = stats[player['ai']]
+            s['seats'] += 1
+            s['wins'] += player['winner']
+            s['kills'] += player['kills']
+            for cause, count in player['deaths'].items():
+                s['deaths'][cause] += count
+
+    summary = {
+        'matches': len(results),
+        'mean_ticks': sum(r['ticks'] for r in results) / float(len(results)),
+        'ais': {},
+        'crashed': crashed,
+    }
+    for name in ai_names:
+        s = stats[name]
+        summary['ais'][name] = dict(s,
+            rating=ratings[name],
+            rating_interval=intervals[name],
+            kills_per_match=s['kills'] / float(max(s['seats'], 1)))
+    return summary
+
+def print_summary(summary, think_time=None):
+    print "%d matches, %.0f ticks on average" % (summary['matches'], summary['mean_ticks'])
+    print "%-10s %7s %17s %6s %8s  %s" % ('AI', 'Rating', '95% interval', 'Wins', 'Kills/m', 'Deaths (' + '/'.join(DEATH_CAUSES) + ')')
+    for name, s in sorted(summary['ais'].items(), key=lambda item: -item[1]['rating']):
+        print "%-10s %7.0f %8.0f - %6.0f %6d %8.2f  %s" % (name, s['rating'],
+                s['rating_interval'][0], s['rating_interval'][1], s['wins'],
+                s['kills_per_match'], '/'.join(str(s['deaths'][c]) for c in DEATH_CAUSES))
+    if summary['crashed']:
+        print "%d matches crashed and were left out of the ratings; replay one with" % len(summary['crashed'])
+        print "simulation.py, e.g. python simulation.py LEVEL --seed SEED --ai AI --ai AI ...%s" % (
+                " --think-time %g" % think_time if think_time is not None else "")
+        for result in summary['crashed']:
+            print "  match %d, %s, seed %d, %s: %s at tick %d" % (result['index'], result['level'], result['seed'],
+                    '/'.join(result['lineup']), result['traceback'].strip().splitlines()[-1], result['ticks'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate the AIs over many headless matches.")
+    parser.add_argument('--matches', type=int, default=60, help="Number of matches to play")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--ticks', type=int, default=9000, help="Maximum length of a match in ticks")
+    parser.add_argument('--seed', type=int, default=0, help="Seed the match seeds are drawn from")
+    parser.add_argument('--ai', action='append', choices=sorted(simulation.AI_CLASSES), help="AI to include (default: all)")
+    parser.add_argument('--think-time', type=float, help="Seconds an AI with a search deadline (JameelAI) may think per move")
+    parser.add_argument('--json', help="Also write the raw results and summary to this file")
+    args = parser.parse_args()
+
+    ai_names = args.ai or sorted(simulation.AI_CLASSES)
+    level_files = sorted(os.path.join('levels', f) for f in os.listdir('levels'))
+    matches = schedule_matches(args.matches, ai_names, level_files, 4, args.seed, args.ticks, args.think_time)
+
+    start_time = time.time()
+    pool = multiprocessing.Pool(args.processes, init_worker)
+    results = []
+    for result in pool.imap_unordered(play_match, matches):
+        results.append(result)
+        sys.stderr.write("\r%d/%d matches" % (len(results), len(matches)))
+    pool.close()
+    pool.join()
+    sys.stderr.write("\n")
+    elapsed = time.time() - start_time
+
+    # Ratings depend on match order, so rate in schedule order
+    results.sort(key=lambda r: r['index'])
+    summary = summarize(results, ai_names, args.seed)
+    print_summary(summary, args.think_time)
+    print "Played in %.1fs on %d processes" % (elapsed, args.processes)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
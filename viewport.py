@@ -0,0 +1,107 @@
+""" The part of the board shown on screen.
+
+    A board can be far larger than the window, so everything is drawn through
+    a viewport: a window of at most VIEW_WIDTH x VIEW_HEIGHT cells that wraps
+    around the board's edges like the snakes do. Drawing code asks it where a
+    cell is on screen and which cells are in view, so the cost of a frame
+    depends on the size of the window and not on the size of the board.
+
+    The viewport follows a snake. It scrolls only when the snake's head comes
+    within a quarter of the view from an edge, so most frames don't scroll
+    and the dirty renderer can still repaint just what changed. On boards
+    that fit the window it never moves.
+"""
+import numpy
+import pygame
+
+import game
+
+class Viewport(object):
+    def __init__(self, board_width, board_height):
+        self.board_width = board_width
+        self.board_height = board_height
+        self.width = min(game.VIEW_WIDTH, board_width)
+        self.height = min(game.VIEW_HEIGHT, board_height)
+        self.margin_x = self.width // 4
+        self.margin_y = self.height // 4
+        self.x = 0  # Board cell at the top-left corner of the view
+        self.y = 0
+        self.target = None  # Player the view follows
+        self.indices = None
+        self._update_indices()
+
+    def _update_indices(self):
+        """ _indices_ holds the flat board index of every cell in view, as a
+            [x, y] array the size of the view. """
+        xs = (self.x + numpy.arange(self.width)) % self.board_width
+        ys = (self.y + numpy.arange(self.height)) % self.board_height
+        self.indices = xs[:, None] * self.board_height + ys[None, :]
+
+    def follow(self, player):
+        self.target = player
+        if player is not None:
+            self.center(player.x, player.y)
+
+    def center(self, x, y):
+        self.move(x - self.width // 2, y - self.height // 2)
+
+    def move(self, x, y):
+        """ Puts board cell (x, y) at the top-left corner, along the axes the
+            board doesn't fit the view on. Returns whether the view moved. """
+        x = x % self.board_width if self.width < self.board_width else 0
+        y = y % self.board_height if self.height < self.board_height else 0
+        if (x, y) == (self.x, self.y):
+            return False
+        self.x, self.y = x, y
+        self._update_indices()
+        return True
+
+    def update(self):
+        """ Scrolls the followed snake's head back out of the margins. Returns
+            whether the view moved. """
+        target = self.target
+        if target is None or target.is_dead:
+            return False
+        view = self.to_view(target.x, target.y)
+        if view is None:
+            # Respawned out of sight
+            self.center(target.x, target.y)
+            return True
+        view_x, view_y = view
+        x, y = self.x, self.y
+        if view_x < self.margin_x:
+            x -= self.margin_x - view_x
+        elif view_x >= self.width - self.margin_x:
+            x += view_x - (self.width - self.margin_x - 1)
+        if view_y < self.margin_y:
+            y -= self.margin_y - view_y
+        elif view_y >= self.height - self.margin_y:
+            y += view_y - (self.height - self.margin_y - 1)
+        return self.move(x, y)
+
+    def to_view(self, x, y):
+        """ Position of board cell (x, y) in the view, or None if it isn't in
+            view. """
+        view_x = (x - self.x) % self.board_width
+        view_y = (y - self.y) % self.board_height
+        if view_x >= self.width or view_y >= self.height:
+            return None
+        return view_x, view_y
+
+    def is_visible(self, x, y):
+        return self.to_view(x, y) is not None
+
+    def cell_rect(self, x, y):
+        """ Screen area of board cell (x, y); off screen if it isn't in view. """
+        view_x = (x - self.x) % self.board_width
+        view_y = (y - self.y) % self.board_height
+        return pygame.Rect(view_x*game.CELL_WIDTH, view_y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT)
+
+    def shift(self, x, y):
+        """ Offset from board pixels to screen pixels for things drawn around
+            the board pixel (x, y), such as an effect's particles. """
+        cell_x = int(x) // game.CELL_WIDTH
+        cell_y = int(y) // game.CELL_HEIGHT
+        view_x = (cell_x - self.x) % self.board_width
+        view_y = (cell_y - self.y) % self.board_height
+        return (view_x - cell_x) * game.CELL_WIDTH, (view_y - cell_y) * game.CELL_HEIGHT